@@ -0,0 +1,248 @@
+"""Benchmark the AccountManager hot paths against synthetic inventories.
+
+Usage:
+    python bench.py                                  # 10k/100k/1M items, 1M cooldown users
+    python bench.py --sizes 10000 --users 100000     # quicker run
+    python bench.py --compare bench_results/old.json # show changes against a previous run
+
+Every run works in a throwaway directory, so the real databases are never touched.
+Results are written as JSON to bench_results/ for regression comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate_inventory(size, services, used_ratio):
+    """Build a synthetic accounts database with `size` items"""
+    accounts = {"free": {}, "premium": {}}
+    now = datetime.now()
+    for i in range(size):
+        tier = "premium" if i % 5 == 0 else "free"
+        service = f"service{i % services:03d}"
+        used = random.random() < used_ratio
+        accounts[tier].setdefault(service, []).append({
+            "credentials": f"user{i}@example.com:{secrets.token_urlsafe(12)}",
+            "used": used,
+            "used_by": random.randrange(10**17, 10**18) if used else None,
+            "used_at": (now - timedelta(seconds=random.randrange(30 * 86400))).isoformat() if used else None
+        })
+    return accounts
+
+
+def generate_cooldowns(users):
+    """Build a synthetic cooldown table with `users` entries"""
+    now = datetime.now()
+    return {
+        str(10**17 + i): {"last_free": (now - timedelta(seconds=random.randrange(2 * 86400))).isoformat()}
+        for i in range(users)
+    }
+
+
+def measure(func, iterations):
+    """Time `func` over several iterations, then measure its peak memory once"""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 3),
+        "max_ms": round(timings[-1], 3),
+        "peak_bytes": peak
+    }
+
+
+def resident_bytes(func):
+    """Memory still allocated by func's return value"""
+    tracemalloc.start()
+    value = func()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del value
+    return current
+
+
+def run_size(gen, web_app, size, args):
+    """Run every benchmark against an inventory of `size` items"""
+    AccountManager = gen.AccountManager
+    print(f"Generating {size:,} items...", flush=True)
+    AccountManager.save_accounts(generate_inventory(size, args.services, args.used_ratio))
+    results = {
+        "snapshot_file_bytes": os.path.getsize(gen.ACCOUNTS_SNAPSHOT),
+        "accounts_file_bytes": len(json.dumps(AccountManager.get_accounts(), indent=4))
+    }
+
+    print("  cold start", flush=True)
+
+    def cold_start():
+        AccountManager.partition().stock.reset()
+        AccountManager.get_stats_counts()
+
+    results["cold_start"] = measure(cold_start, args.iterations)
+
+    print("  resident memory", flush=True)
+    results["json_bytes_per_item"] = round(resident_bytes(AccountManager.get_accounts) / size, 1)
+
+    def load_all_columns():
+        AccountManager.partition().stock.reset()
+        stock = AccountManager.get_stock()
+        for services in stock.values():
+            for service_stock in services.values():
+                service_stock.data
+        return stock
+
+    results["stock_bytes_per_item"] = round(resident_bytes(load_all_columns) / size, 1)
+
+    print("  get_random_account", flush=True)
+    results["get_random_account"] = measure(
+        lambda: AccountManager.get_random_account("free"), args.iterations
+    )
+    results["get_random_account_service"] = measure(
+        lambda: AccountManager.get_random_account("free", "service001"), args.iterations
+    )
+
+    print("  get_stats_counts", flush=True)
+    results["get_stats_counts"] = measure(AccountManager.get_stats_counts, args.iterations)
+
+    print("  add_account bulk import", flush=True)
+    batch = [f"import{i}@example.com:{secrets.token_urlsafe(12)}" for i in range(args.import_batch)]
+
+    def bulk_import():
+        for credentials in batch:
+            AccountManager.add_account("free", "imported", credentials)
+
+    results["add_account_bulk"] = measure(bulk_import, 1)
+    results["add_account_bulk"]["items"] = args.import_batch
+    if hasattr(AccountManager, "add_accounts"):
+        results["add_accounts_batch"] = measure(
+            lambda: AccountManager.add_accounts("free", "imported", batch), 1
+        )
+        results["add_accounts_batch"]["items"] = args.import_batch
+
+    print("  dashboard render", flush=True)
+    client = web_app.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+
+    def render_dashboard():
+        response = client.get('/dashboard')
+        assert response.status_code == 200
+
+    results["dashboard"] = measure(render_dashboard, args.iterations)
+    return results
+
+
+def run_cooldowns(gen, args):
+    """Run the cooldown benchmarks against a table of `args.users` users"""
+    AccountManager = gen.AccountManager
+    print(f"Generating {args.users:,} cooldown entries...", flush=True)
+    AccountManager.save_cooldowns(generate_cooldowns(args.users))
+    user_ids = [10**17 + random.randrange(args.users) for _ in range(args.iterations)]
+    results = {"cooldowns_file_bytes": os.path.getsize(gen.COOLDOWNS_DB)}
+
+    print("  check_cooldown / update_cooldown", flush=True)
+    ids = iter(user_ids * 2)
+    results["check_cooldown"] = measure(
+        lambda: AccountManager.check_cooldown(next(ids), "free"), args.iterations
+    )
+    ids = iter(user_ids * 2)
+    results["update_cooldown"] = measure(
+        lambda: AccountManager.update_cooldown(next(ids), "free"), args.iterations
+    )
+    return results
+
+
+def compare(current, previous):
+    """Print mean latency and peak memory changes against a previous run"""
+    print(f"\nChanges against {previous.get('created_at', 'previous run')}:")
+    for group, benchmarks in current["results"].items():
+        old_group = previous.get("results", {}).get(group, {})
+        for name, result in benchmarks.items():
+            old = old_group.get(name)
+            if not isinstance(result, dict) or not isinstance(old, dict):
+                continue
+            mean_change = (result["mean_ms"] - old["mean_ms"]) / old["mean_ms"] * 100 if old["mean_ms"] else 0
+            peak_change = (result["peak_bytes"] - old["peak_bytes"]) / old["peak_bytes"] * 100 if old["peak_bytes"] else 0
+            print(
+                f"  {group:>10} {name:<28} mean {old['mean_ms']:>10.3f} -> {result['mean_ms']:>10.3f} ms "
+                f"({mean_change:+.1f}%)  peak {peak_change:+.1f}%"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AccountManager hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--users", type=int, default=1_000_000, help="Cooldown table size")
+    parser.add_argument("--services", type=int, default=200)
+    parser.add_argument("--used-ratio", type=float, default=0.9)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--import-batch", type=int, default=100, help="Items per bulk import")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Results file (default: bench_results/bench-<time>.json)")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    output = args.output or os.path.join(
+        REPO_DIR, "bench_results", f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output = os.path.abspath(output)
+
+    # The bot and panel use relative database paths, so run them from a scratch directory
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    try:
+        import gen
+        import web_app
+
+        report = {
+            "created_at": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "results": {}
+        }
+        for size in args.sizes:
+            report["results"][str(size)] = run_size(gen, web_app, size, args)
+        report["results"]["cooldowns"] = run_cooldowns(gen, args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Run the bot as several processes, each owning a range of shards.
+
+Usage:
+    python cluster.py                            # one cluster per CPU, Discord's recommended shard count
+    python cluster.py --clusters 4 --shards 16   # 4 processes x 4 shards
+
+A supervisor process starts the clusters and restarts any that crash, with an
+exponential backoff. All clusters share the same database files; claims and
+other read-modify-write operations hold a cross-process file lock.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import urllib.request
+
+CONFIG_FILE = 'config.json'
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('bot.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger('cluster')
+
+# A cluster that stays up this long has its restart backoff reset
+STABLE_SECONDS = 60
+MAX_BACKOFF = 300
+
+
+def recommended_shards(token):
+    """Ask Discord how many shards this bot should run"""
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (cluster.py, 1.0)"}
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)["shards"]
+
+
+def split_shards(shard_count, clusters):
+    """Split shard ids into contiguous, evenly sized ranges"""
+    clusters = max(1, min(clusters, shard_count))
+    size, extra = divmod(shard_count, clusters)
+    ranges, start = [], 0
+    for i in range(clusters):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def run_cluster(cluster_id, shard_ids, shard_count):
+    """Cluster process entry point"""
+    # Imported here so the supervisor never builds a bot of its own
+    import gen
+    gen.run_cluster(cluster_id, shard_ids, shard_count)
+
+
+class Supervisor:
+    def __init__(self, shard_ranges, shard_count):
+        self.shard_ranges = shard_ranges
+        self.shard_count = shard_count
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = {}
+        self.started_at = {}
+        self.backoff = {}
+        self.restart_at = {}
+        self.stopping = False
+
+    def start(self, cluster_id):
+        process = self.context.Process(
+            target=run_cluster,
+            args=(cluster_id, self.shard_ranges[cluster_id], self.shard_count),
+            name=f"cluster-{cluster_id}"
+        )
+        process.start()
+        self.processes[cluster_id] = process
+        self.started_at[cluster_id] = time.monotonic()
+        logger.info(
+            f"Started cluster {cluster_id} (pid {process.pid}) "
+            f"with shards {self.shard_ranges[cluster_id][0]}-{self.shard_ranges[cluster_id][-1]}"
+        )
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def check(self):
+        """Schedule restarts for dead clusters and start those that are due"""
+        now = time.monotonic()
+        for cluster_id, process in list(self.processes.items()):
+            if process.is_alive() or cluster_id in self.restart_at:
+                continue
+            if now - self.started_at[cluster_id] >= STABLE_SECONDS:
+                self.backoff[cluster_id] = 1
+            delay = self.backoff.get(cluster_id, 1)
+            self.backoff[cluster_id] = min(delay * 2, MAX_BACKOFF)
+            self.restart_at[cluster_id] = now + delay
+            logger.error(
+                f"Cluster {cluster_id} exited with code {process.exitcode}, restarting in {delay}s"
+            )
+
+        for cluster_id, due in list(self.restart_at.items()):
+            if now >= due:
+                del self.restart_at[cluster_id]
+                self.start(cluster_id)
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        for cluster_id in range(len(self.shard_ranges)):
+            self.start(cluster_id)
+
+        while not self.stopping:
+            self.check()
+            time.sleep(1)
+
+        logger.info("Stopping clusters...")
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                process.kill()
+
+
+def main():
+    with open(CONFIG_FILE, 'r') as f:
+        config = json.load(f)
+    cluster_config = config.get('cluster', {})
+
+    parser = argparse.ArgumentParser(description="Run the bot as multiple shard clusters")
+    parser.add_argument("--clusters", type=int, default=cluster_config.get('clusters') or os.cpu_count())
+    parser.add_argument("--shards", type=int, default=cluster_config.get('shard_count'),
+                        help="Total shard count (default: Discord's recommendation)")
+    args = parser.parse_args()
+
+    shard_count = args.shards or recommended_shards(config['token'])
+    shard_ranges = split_shards(shard_count, args.clusters)
+    logger.info(f"Running {shard_count} shard(s) across {len(shard_ranges)} cluster(s)")
+    Supervisor(shard_ranges, shard_count).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,42 @@ import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 import os
+import io
+import asyncio
 import random
 import json
+import math
+import sys
+import tempfile
+import threading
+import time
+import traceback
 import logging
+import functools
+import hashlib
+import hmac
+import inspect
+import contextvars
+import cProfile
+import pstats
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+    import resource
+from aiohttp import web
+
+import metrics
+from storage import (
+    file_lock, atomic_write, load_stock, plan_waves, stage_drop, iter_export_rows, iter_export_lines,
+    Partition, PartitionCache
+)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -19,11 +49,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Structured slow-command log, one JSON object per line
+slow_logger = logging.getLogger('slowlog')
+slow_logger.propagate = False
+if not slow_logger.handlers:
+    _slow_handler = logging.FileHandler('slow.log')
+    _slow_handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_logger.addHandler(_slow_handler)
+
 # Constants
 CONFIG_FILE = 'config.json'
-ACCOUNTS_DB = 'accounts.json'
+ACCOUNTS_DB = 'accounts.json'  # Legacy format, only read to migrate
+ACCOUNTS_SNAPSHOT = 'accounts.snap'
+ACCOUNTS_LOG = 'accounts.log'
 COOLDOWNS_DB = 'cooldowns.json'
 STATS_DB = 'stats.json'
+COMMAND_TREE_DB = 'command_tree.json'
+DROPS_DB = 'drops.json'  # Pending drops across all partitions
 
 DEFAULT_CONFIG = {
     "token": "YOUR_BOT_TOKEN_HERE",
@@ -40,17 +82,162 @@ DEFAULT_CONFIG = {
         "Generating accounts!",
         "Use /help for commands",
         "Premium accounts available!"
-    ]
+    ],
+    "metrics": {
+        "enabled": True,
+        "host": "127.0.0.1",
+        "port": 9100
+    },
+    "profiling": {
+        "slow_command_ms": 500
+    },
+    "sync_commands": "auto",  # auto (only when changed), always or never
+    # Minimal intents, no member cache and no chunking; roles come from interaction/message payloads
+    "lean_gateway": False,
+    "storage": {
+        "compact_log_bytes": 16 * 1024 * 1024  # Fold the stock log into a new snapshot past this size
+    },
+    # Separate stock, cooldowns, stats and config overrides per guild, under guilds/<id>/
+    "partitions": {
+        "by_guild": False,
+        "idle_seconds": 1800
+    },
+    # Seconds a claim's interaction id is remembered, so retries get the same account
+    "claim_key_ttl": 900,
+    "batch_claim_max": 1000,  # Most accounts one /batchclaim may pull
+    "health": {
+        "stall_seconds": 0.5,  # Log the loop's stack when a callback blocks this long
+        "unhealthy_lag_seconds": 5,
+        "unhealthy_window_seconds": 60,
+        "max_gateway_latency": 10,
+        "storage_timeout": 5
+    },
+    # Anonymized command invocations for replay.py; user and guild ids are hashed
+    "trace": {
+        "enabled": False,
+        "path": "trace.ndjson",
+        "salt": ""  # Secret hash key shared by every process; empty derives one from the bot token
+    }
 }
 
+# Settings a guild's config.json may override
+GUILD_CONFIG_KEYS = ("admin_roles", "premium_roles", "cooldown", "embed_color", "log_channel")
+
+# Used to measure startup time
+PROCESS_STARTED = time.monotonic()
+
+# Metrics
+COMMAND_LATENCY = metrics.Histogram(
+    "bot_command_duration_seconds", "Command latency in seconds", ["command"]
+)
+STORAGE_LATENCY = metrics.Histogram(
+    "bot_storage_duration_seconds", "Storage read/write latency in seconds", ["op", "file"]
+)
+STORAGE_BYTES = metrics.Counter(
+    "bot_storage_bytes_total", "Bytes read from and written to storage", ["op", "file"]
+)
+CLAIMS = metrics.Counter(
+    "bot_claims_total", "Account claims by outcome", ["tier", "outcome"]
+)
+STOCK_LEVEL = metrics.Gauge(
+    "bot_stock_available", "Available accounts per tier and service", ["tier", "service"]
+)
+LOOP_LAG = metrics.Gauge(
+    "bot_event_loop_lag_seconds", "Delay of a scheduled event loop wakeup"
+)
+GATEWAY_LATENCY = metrics.Gauge(
+    "bot_gateway_latency_seconds", "Gateway heartbeat latency per shard", ["shard"]
+)
+LOOP_STALLS = metrics.Counter(
+    "bot_event_loop_stalls_total", "Times a callback blocked the event loop past the stall threshold"
+)
+PROCESS_RSS = metrics.Gauge(
+    "bot_process_rss_bytes", "Resident memory of the bot process"
+)
+STARTUP_TIME = metrics.Gauge(
+    "bot_startup_seconds", "Seconds from process start to the first ready event"
+)
+
+# Per-invocation profile of the running command, set by the before_invoke hook
+_invoke_profile = contextvars.ContextVar('invoke_profile', default=None)
+
+def new_invoke_profile():
+    """Create an empty per-invocation profile"""
+    return {
+        "depth": 0,
+        "storage_seconds": 0.0,
+        "storage_calls": 0,
+        "bytes_read": 0,
+        "bytes_serialized": 0
+    }
+
+def count_claim(tier, outcome):
+    """Count a claim outcome and note it on the running command's profile"""
+    CLAIMS.inc(tier=tier, outcome=outcome)
+    profile = _invoke_profile.get()
+    if profile is not None:
+        profile["claim"] = (tier, outcome)
+
+def profiled_call(func):
+    """Attribute time spent in an AccountManager call to the running command"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _invoke_profile.get()
+        if profile is None or profile["depth"]:
+            return func(*args, **kwargs)
+        profile["depth"] += 1
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile["depth"] -= 1
+            profile["storage_seconds"] += time.perf_counter() - start
+            profile["storage_calls"] += 1
+    return wrapper
+
+def record_store_io(op, path, seconds, nbytes):
+    """Report stock snapshot and log I/O to metrics and the running command's profile"""
+    # Guild partitions share file names, so the label stays bounded however many guilds are active
+    STORAGE_LATENCY.observe(seconds, op=op, file=os.path.basename(path))
+    STORAGE_BYTES.inc(nbytes, op=op, file=os.path.basename(path))
+    profile = _invoke_profile.get()
+    if profile is not None:
+        key = "bytes_serialized" if op in ("append", "snapshot_write") else "bytes_read"
+        profile[key] += nbytes
+
+def new_partition(guild_id):
+    """Open a guild's databases, or the top-level ones for None"""
+    return Partition(
+        guild_id,
+        on_io=record_store_io,
+        claim_key_ttl=config.get('claim_key_ttl', DEFAULT_CONFIG['claim_key_ttl'])
+    )
+
 class AccountManager:
+    # Per-guild databases, loaded on first use and evicted when idle; None is the top-level partition
+    _partitions = PartitionCache(new_partition)
+
+    @staticmethod
+    def partition(guild_id=None):
+        """Databases for a guild, or the shared ones when partitioning is off"""
+        if not config.get('partitions', DEFAULT_CONFIG['partitions'])['by_guild']:
+            guild_id = None
+        return AccountManager._partitions.get(guild_id)
+
     @staticmethod
     def load_db(file_path, default={}):
         """Load JSON database file"""
         try:
             if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    return json.load(f)
+                with STORAGE_LATENCY.time(op="read", file=os.path.basename(file_path)):
+                    with open(file_path, 'rb') as f:
+                        raw = f.read()
+                    data = json.loads(raw)
+                STORAGE_BYTES.inc(len(raw), op="read", file=os.path.basename(file_path))
+                profile = _invoke_profile.get()
+                if profile is not None:
+                    profile["bytes_read"] += len(raw)
+                return data
             return default.copy()
         except Exception as e:
             logger.error(f"Failed to load {file_path}: {e}")
@@ -60,130 +247,327 @@ class AccountManager:
     def save_db(file_path, data):
         """Save data to JSON database file"""
         try:
-            with open(file_path, 'w') as f:
-                json.dump(data, f, indent=4)
+            with STORAGE_LATENCY.time(op="write", file=os.path.basename(file_path)):
+                raw = json.dumps(data, indent=4).encode('utf-8')
+                atomic_write(file_path, raw, binary=True)
+            STORAGE_BYTES.inc(len(raw), op="write", file=os.path.basename(file_path))
+            profile = _invoke_profile.get()
+            if profile is not None:
+                profile["bytes_serialized"] += len(raw)
             return True
         except Exception as e:
             logger.error(f"Failed to save {file_path}: {e}")
             return False
 
     @staticmethod
-    def get_accounts():
+    def get_config(guild_id=None):
+        """Load the config on top of the defaults, with a guild's overrides applied"""
+        # config.json may be missing sections, e.g. when the panel created it
+        config = {key: dict(value) if isinstance(value, dict) else value for key, value in DEFAULT_CONFIG.items()}
+        layers = [AccountManager.load_db(CONFIG_FILE)]
+        partition = AccountManager.partition(guild_id)
+        if partition.guild_id is not None:
+            overrides = AccountManager.load_db(partition.config_db)
+            layers.append({key: value for key, value in overrides.items() if key in GUILD_CONFIG_KEYS})
+
+        for layer in layers:
+            for key, value in layer.items():
+                if isinstance(value, dict) and isinstance(config.get(key), dict):
+                    config[key] = {**config[key], **value}
+                else:
+                    config[key] = value
+        return config
+
+    @staticmethod
+    def set_guild_config(guild_id, key, value=None, subkey=None):
+        """Set a guild config override (or one entry of a section); None removes it"""
+        partition = AccountManager.partition(guild_id)
+        if partition.guild_id is None:
+            return False
+        with file_lock(partition.config_db):
+            overrides = AccountManager.load_db(partition.config_db)
+            if subkey:
+                section = overrides.get(key, {})
+                if value is None:
+                    section.pop(subkey, None)
+                else:
+                    section[subkey] = value
+                value = section or None
+            if value is None:
+                overrides.pop(key, None)
+            else:
+                overrides[key] = value
+            return AccountManager.save_db(partition.config_db, overrides)
+
+    @staticmethod
+    def get_accounts(guild_id=None):
         """Load all accounts"""
-        return AccountManager.load_db(ACCOUNTS_DB, {"free": {}, "premium": {}})
+        stock = AccountManager.get_stock(guild_id)
+        return {
+            acc_type: {service: list(service_stock) for service, service_stock in services.items()}
+            for acc_type, services in stock.items()
+        }
 
     @staticmethod
-    def save_accounts(accounts):
+    def save_accounts(accounts, guild_id=None):
         """Save all accounts"""
-        return AccountManager.save_db(ACCOUNTS_DB, accounts)
+        store = AccountManager.partition(guild_id).stock
+        try:
+            store.replace(load_stock(accounts))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save {store.snapshot_path}: {e}")
+            store.reset()
+            return False
 
     @staticmethod
-    def get_cooldowns():
+    def get_stock(guild_id=None):
+        """Load all accounts as {type: {service: ServiceStock}}"""
+        return AccountManager.partition(guild_id).stock.read()
+
+    @staticmethod
+    def get_cooldowns(guild_id=None):
         """Load all cooldowns"""
-        return AccountManager.load_db(COOLDOWNS_DB)
+        return AccountManager.load_db(AccountManager.partition(guild_id).cooldowns_db)
 
     @staticmethod
-    def save_cooldowns(cooldowns):
+    def save_cooldowns(cooldowns, guild_id=None):
         """Save all cooldowns"""
-        return AccountManager.save_db(COOLDOWNS_DB, cooldowns)
+        return AccountManager.save_db(AccountManager.partition(guild_id).cooldowns_db, cooldowns)
 
     @staticmethod
-    def get_stats():
+    def get_stats(guild_id=None):
         """Load statistics"""
-        return AccountManager.load_db(STATS_DB, {
+        return AccountManager.load_db(AccountManager.partition(guild_id).stats_db, {
             "free_generated": 0,
             "premium_generated": 0,
             "accounts_added": 0
         })
 
     @staticmethod
-    def save_stats(stats):
+    def save_stats(stats, guild_id=None):
         """Save statistics"""
-        return AccountManager.save_db(STATS_DB, stats)
+        return AccountManager.save_db(AccountManager.partition(guild_id).stats_db, stats)
 
     @staticmethod
-    def add_account(account_type, service, credentials):
+    def add_account(account_type, service, credentials, guild_id=None):
         """Add a new account to the database"""
-        accounts = AccountManager.get_accounts()
-        
-        if service not in accounts[account_type]:
-            accounts[account_type][service] = []
-            
-        accounts[account_type][service].append({
-            "credentials": credentials,
-            "used": False,
-            "used_by": None,
-            "used_at": None
-        })
-        
-        if AccountManager.save_accounts(accounts):
-            # Update stats
-            stats = AccountManager.get_stats()
-            stats["accounts_added"] += 1
-            AccountManager.save_stats(stats)
-            return True
-        return False
+        return AccountManager.add_accounts(account_type, service, [credentials], guild_id) == 1
 
     @staticmethod
-    def get_random_account(account_type, service=None):
-        """Get a random unused account"""
-        accounts = AccountManager.get_accounts()
-        
-        if account_type not in accounts:
+    def add_accounts(account_type, service, credentials_list, guild_id=None):
+        """Add many accounts to the database in one write"""
+        store = AccountManager.partition(guild_id).stock
+        try:
+            with store.transaction():
+                store.append({
+                    "op": "add",
+                    "tier": account_type,
+                    "service": service,
+                    "credentials": list(credentials_list)
+                })
+        except Exception as e:
+            logger.error(f"Failed to save {store.log_path}: {e}")
+            store.reset()
+            return 0
+
+        # Update stats
+        AccountManager.update_stat("accounts_added", len(credentials_list), guild_id)
+        return len(credentials_list)
+
+    @staticmethod
+    def bulk_update(record, dry_run=False, guild_id=None):
+        """Count the items a purge, move or requeue record touches and, unless dry_run, apply it"""
+        store = AccountManager.partition(guild_id).stock
+        try:
+            return store.apply_bulk(record, dry_run)
+        except Exception as e:
+            logger.error(f"Failed to apply {record['op']} to {store.log_path}: {e}")
+            raise
+
+    @staticmethod
+    def _claimed_item(store, stock, key):
+        """The account an earlier claim with this key returned, or None"""
+        claimed = store.claimed(key) if key else None
+        if not claimed:
             return None
-            
-        if service:
-            if service not in accounts[account_type]:
+        tier, service, index, delivered = claimed
+        return {**stock[tier][service].item(index), "service": service, "replayed": True, "delivered": delivered}
+
+    @staticmethod
+    def get_claimed_account(key, guild_id=None):
+        """The account already claimed under an idempotency key, or None"""
+        if not key:
+            return None
+        store = AccountManager.partition(guild_id).stock
+        with store.transaction() as stock:
+            return AccountManager._claimed_item(store, stock, key)
+
+    @staticmethod
+    def mark_claim_delivered(key, delivered=True, guild_id=None):
+        """Record whether the account claimed under a key reached the user"""
+        if not key:
+            return
+        store = AccountManager.partition(guild_id).stock
+        with store.transaction():
+            store.mark_delivered(key, delivered)
+
+    @staticmethod
+    def get_drops():
+        """Load pending drops"""
+        return AccountManager.load_db(DROPS_DB)
+
+    @staticmethod
+    def save_drops(drops):
+        """Save pending drops"""
+        return AccountManager.save_db(DROPS_DB, drops)
+
+    @staticmethod
+    def stage_drop(account_type, service, credentials_list, waves, guild_id=None):
+        """Import accounts now but keep them hidden until their release waves; returns the drop id"""
+        partition = AccountManager.partition(guild_id)
+        try:
+            drop_id = stage_drop(partition, DROPS_DB, account_type, service, credentials_list, waves)
+        except Exception as e:
+            logger.error(f"Failed to stage drop in {partition.stock.log_path}: {e}")
+            return None
+
+        AccountManager.update_stat("accounts_added", len(credentials_list), partition.guild_id)
+        return drop_id
+
+    @staticmethod
+    def release_due_drops(now=None):
+        """Release every drop wave that is due; returns [(drop_id, released), ...]"""
+        now = now or time.time()
+        released = []
+        with file_lock(DROPS_DB):
+            drops = AccountManager.get_drops()
+            if not drops:
+                return released
+
+            for drop_id, drop in list(drops.items()):
+                due = sum(count for release_at, count in drop["waves"] if release_at <= now)
+                if due <= drop["released"]:
+                    continue
+
+                store = AccountManager.partition(drop["guild_id"]).stock
+                with store.transaction() as stock:
+                    service_stock = stock.get(drop["tier"], {}).get(drop["service"])
+                    entry = service_stock.staged.get(drop_id) if service_stock else None
+                    if entry is None:
+                        # Already fully released, or the stock was replaced
+                        del drops[drop_id]
+                        continue
+                    start = entry[1] - drop["items"]
+                    # One small record however large the wave; replaying it twice is harmless
+                    store.append({
+                        "op": "release",
+                        "tier": drop["tier"],
+                        "service": drop["service"],
+                        "drop": drop_id,
+                        "until": start + due
+                    })
+
+                released.append((drop_id, due - drop["released"]))
+                drop["released"] = due
+                if due >= drop["items"]:
+                    del drops[drop_id]
+
+            AccountManager.save_drops(drops)
+        return released
+
+    @staticmethod
+    def release_drop_now(drop_id):
+        """Release all remaining items of a drop immediately"""
+        with file_lock(DROPS_DB):
+            drops = AccountManager.get_drops()
+            if drop_id not in drops:
                 return None
-                
-            available = [acc for acc in accounts[account_type][service] if not acc["used"]]
-            if not available:
+            drops[drop_id]["waves"] = [[0, drops[drop_id]["items"]]]
+            AccountManager.save_drops(drops)
+            released = dict(AccountManager.release_due_drops())
+        return released.get(drop_id, 0)
+
+    @staticmethod
+    def get_random_account(account_type, service=None, user_id=None, guild_id=None, key=None):
+        """Get a random unused account; repeating a key returns the same account"""
+        store = AccountManager.partition(guild_id).stock
+        with store.transaction() as stock:
+            replayed = AccountManager._claimed_item(store, stock, key)
+            if replayed:
+                return replayed
+
+            if account_type not in stock:
                 return None
-                
-            account = random.choice(available)
-            account["used"] = True
-            account["used_at"] = datetime.now().isoformat()
-            AccountManager.save_accounts(accounts)
-            return account
             
-        else:
-            # Get all available accounts of the type
-            available = []
-            for serv, acc_list in accounts[account_type].items():
-                available.extend([{**acc, "service": serv} for acc in acc_list if not acc["used"]])
+            if service:
+                service_stock = stock[account_type].get(service)
+                if not service_stock or not service_stock.available:
+                    return None
+            
+            else:
+                # Weight by stock so every unused account is equally likely
+                candidates = [(serv, s) for serv, s in stock[account_type].items() if s.available]
+                if not candidates:
+                    return None
                 
-            if not available:
+                service, service_stock = random.choices(
+                    candidates, weights=[s.available for _, s in candidates]
+                )[0]
+            
+            index = service_stock.pick_random()
+            if index is None:
                 return None
-                
-            account = random.choice(available)
-            # Mark as used
-            accounts[account_type][account["service"]][
-                accounts[account_type][account["service"]].index(account)
-            ]["used"] = True
-            accounts[account_type][account["service"]][
-                accounts[account_type][account["service"]].index(account)
-            ]["used_at"] = datetime.now().isoformat()
-            AccountManager.save_accounts(accounts)
-            return account
-
-    @staticmethod
-    def get_services(account_type):
+            record = {
+                "op": "claim",
+                "tier": account_type,
+                "service": service,
+                "index": index,
+                "used_by": user_id,
+                "used_at": int(time.time())
+            }
+            if key:
+                record["key"] = key
+            try:
+                store.append(record)
+            except Exception as e:
+                logger.error(f"Failed to save {store.log_path}: {e}")
+                # Memory may be ahead of the disk now; reload on next access
+                store.reset()
+                return None
+            return {**service_stock.item(index), "service": service}
+
+    @staticmethod
+    def claim_batch(account_type, count, services=None, user_id=None, guild_id=None, key=None):
+        """Claim `count` distinct accounts in one write; None if fewer are available.
+
+        Repeating a key returns the same batch.
+        """
+        store = AccountManager.partition(guild_id).stock
+        try:
+            items = store.claim_batch(account_type, count, services, user_id, key)
+        except Exception as e:
+            logger.error(f"Failed to save {store.log_path}: {e}")
+            return None
+        if not items or items[0]["replayed"]:
+            return items
+
+        AccountManager.update_stat(f"{account_type}_generated", len(items), guild_id)
+        return items
+
+    @staticmethod
+    def get_services(account_type, guild_id=None):
         """Get list of services for an account type"""
-        accounts = AccountManager.get_accounts()
-        if account_type not in accounts:
-            return []
-            
-        services = []
-        for service, acc_list in accounts[account_type].items():
-            if any(not acc["used"] for acc in acc_list):
-                services.append(service)
-                
-        return services
+        stock = AccountManager.get_stock(guild_id)
+        return [
+            service for service, service_stock in stock.get(account_type, {}).items()
+            if service_stock.available
+        ]
 
     @staticmethod
-    def get_stats_counts():
+    def get_stats_counts(guild_id=None):
         """Get counts of available accounts"""
-        accounts = AccountManager.get_accounts()
+        stock = AccountManager.get_stock(guild_id)
         stats = {
             "free": 0,
             "premium": 0,
@@ -191,8 +575,8 @@ class AccountManager:
         }
         
         for acc_type in ["free", "premium"]:
-            for service, acc_list in accounts[acc_type].items():
-                available = sum(1 for acc in acc_list if not acc["used"])
+            for service, service_stock in stock[acc_type].items():
+                available = service_stock.available
                 if available > 0:
                     if service not in stats["services"]:
                         stats["services"][service] = {"free": 0, "premium": 0}
@@ -202,9 +586,16 @@ class AccountManager:
         return stats
 
     @staticmethod
-    def check_cooldown(user_id, account_type):
+    def get_claim_trends(guild_id=None):
+        """Claims per hour and day with depletion ETAs, read from the rollups"""
+        store = AccountManager.partition(guild_id).stock
+        with store.transaction() as stock:
+            return store.rollups.trends(stock)
+
+    @staticmethod
+    def check_cooldown(user_id, account_type, guild_id=None):
         """Check if user is on cooldown"""
-        cooldowns = AccountManager.get_cooldowns()
+        cooldowns = AccountManager.get_cooldowns(guild_id)
         user_id = str(user_id)
         
         if user_id not in cooldowns:
@@ -215,7 +606,7 @@ class AccountManager:
             return None
             
         last_used = datetime.fromisoformat(last_used)
-        cooldown_seconds = DEFAULT_CONFIG["cooldown"][account_type]
+        cooldown_seconds = AccountManager.get_config(guild_id)["cooldown"][account_type]
         remaining = (last_used + timedelta(seconds=cooldown_seconds)) - datetime.now()
         
         if remaining.total_seconds() > 0:
@@ -223,47 +614,486 @@ class AccountManager:
         return None
 
     @staticmethod
-    def update_cooldown(user_id, account_type):
+    def update_cooldown(user_id, account_type, guild_id=None):
         """Update user's cooldown"""
-        cooldowns = AccountManager.get_cooldowns()
-        user_id = str(user_id)
+        with file_lock(AccountManager.partition(guild_id).cooldowns_db):
+            cooldowns = AccountManager.get_cooldowns(guild_id)
+            user_id = str(user_id)
         
-        if user_id not in cooldowns:
-            cooldowns[user_id] = {}
+            if user_id not in cooldowns:
+                cooldowns[user_id] = {}
             
-        cooldowns[user_id][f"last_{account_type}"] = datetime.now().isoformat()
-        AccountManager.save_cooldowns(cooldowns)
+            cooldowns[user_id][f"last_{account_type}"] = datetime.now().isoformat()
+            AccountManager.save_cooldowns(cooldowns, guild_id)
 
     @staticmethod
-    def update_stat(stat_type, increment=1):
+    def update_stat(stat_type, increment=1, guild_id=None):
         """Update statistics"""
-        stats = AccountManager.get_stats()
-        stats[stat_type] = stats.get(stat_type, 0) + increment
-        AccountManager.save_stats(stats)
+        with file_lock(AccountManager.partition(guild_id).stats_db):
+            stats = AccountManager.get_stats(guild_id)
+            stats[stat_type] = stats.get(stat_type, 0) + increment
+            AccountManager.save_stats(stats, guild_id)
+
+# Time every storage call made from a command (generators are consumed later, outside the call)
+for _name, _attr in list(vars(AccountManager).items()):
+    if isinstance(_attr, staticmethod) and not inspect.isgeneratorfunction(_attr.__func__):
+        setattr(AccountManager, _name, staticmethod(profiled_call(_attr.__func__)))
+
+class CommandProfiler:
+    """Opt-in sampling profiler for command invocations"""
+    mode = None  # None, "cprofile" or "tracemalloc"
+    sample_rate = 0.0
+    _busy = False
+
+    @staticmethod
+    def enable(mode, sample_rate):
+        CommandProfiler.disable()
+        CommandProfiler.mode = mode
+        CommandProfiler.sample_rate = sample_rate
+        if mode == "tracemalloc":
+            tracemalloc.start()
+
+    @staticmethod
+    def disable():
+        if CommandProfiler.mode == "tracemalloc" and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        CommandProfiler.mode = None
+        CommandProfiler.sample_rate = 0.0
+
+    @staticmethod
+    def start(ctx):
+        """Start profiling this invocation if it is sampled"""
+        # Only one invocation at a time; cProfile sees the whole thread
+        if not CommandProfiler.mode or CommandProfiler._busy:
+            return
+        if random.random() >= CommandProfiler.sample_rate:
+            return
+
+        CommandProfiler._busy = True
+        if CommandProfiler.mode == "cprofile":
+            ctx.profiler = cProfile.Profile()
+            ctx.profiler.enable()
+        else:
+            tracemalloc.reset_peak()
+            ctx.profiler = tracemalloc.get_traced_memory()[0]
+
+    @staticmethod
+    def stop(ctx):
+        """Stop profiling this invocation and return its results"""
+        profiler = getattr(ctx, 'profiler', None)
+        if profiler is None:
+            return None
+
+        CommandProfiler._busy = False
+        ctx.profiler = None
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(15)
+            return {"cprofile": output.getvalue()}
+        if not tracemalloc.is_tracing():
+            return None
+        return {"alloc_peak_bytes": tracemalloc.get_traced_memory()[1] - profiler}
 
 # Initialize config
 config = AccountManager.load_db(CONFIG_FILE, DEFAULT_CONFIG)
+AccountManager._partitions.idle_seconds = config.get('partitions', DEFAULT_CONFIG['partitions'])['idle_seconds']
+
+def get_rss_bytes():
+    """Resident memory of this process"""
+    if psutil:
+        return psutil.Process().memory_info().rss
+    try:
+        # Second field is resident pages
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        pass
+    # Last resort: the peak, which macOS reports in bytes and other systems in kilobytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def has_any_role(member, role_names):
+    """Check a member's roles by name; DM users have no roles"""
+    return any(role.name in role_names for role in getattr(member, 'roles', []))
+
+def guild_id_of(ctx):
+    """Partition key for a command; DMs use the shared databases"""
+    return ctx.guild.id if ctx.guild else None
+
+def claim_key_of(ctx):
+    """Idempotency key for a claim: the interaction id, or the message id for prefix commands"""
+    if getattr(ctx, 'interaction', None):
+        return str(ctx.interaction.id)
+    message = getattr(ctx, 'message', None)
+    return str(message.id) if message else None
 
 # Initialize Discord bot with sharding
-intents = discord.Intents.default()
-intents.messages = True
-intents.guilds = True
-intents.members = True
+if config.get('lean_gateway', DEFAULT_CONFIG['lean_gateway']):
+    # Commands only need the author and their roles, which interaction and
+    # message payloads already carry, so skip the member list entirely
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    member_cache_flags = discord.MemberCacheFlags.none()
+    chunk_guilds_at_startup = False
+else:
+    intents = discord.Intents.default()
+    intents.messages = True
+    intents.guilds = True
+    intents.members = True
+    member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+    chunk_guilds_at_startup = True
 
 class MyBot(commands.AutoShardedBot):
     def __init__(self):
         super().__init__(
             command_prefix=commands.when_mentioned_or(config['prefix']),
             intents=intents,
+            member_cache_flags=member_cache_flags,
+            chunk_guilds_at_startup=chunk_guilds_at_startup,
             help_command=None
         )
+        # Set by run_cluster when running as one process of a cluster
+        self.cluster_id = 0
 
     async def setup_hook(self):
-        await self.tree.sync()
+        watchdog.start(asyncio.get_running_loop())
+        check_gateway_latency.start()
+        compact_stock_log.start()
+        await start_metrics_server()
+        # The command tree and drop schedule are global; only the first cluster handles them
+        if self.cluster_id == 0:
+            release_drops.start()
+            mode = config.get('sync_commands', DEFAULT_CONFIG['sync_commands'])
+            if mode != "never":
+                await sync_command_tree(force=mode == "always")
 
 bot = MyBot()
 
+# Command tree sync
+def command_tree_hash(tree):
+    """Hash the serialized global command definitions"""
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands()),
+        key=lambda command: (command.get('type', 1), command['name'])
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def sync_command_tree(force=False):
+    """Sync application commands, skipping the API call when nothing changed"""
+    tree_hash = command_tree_hash(bot.tree)
+    state = AccountManager.load_db(COMMAND_TREE_DB)
+
+    if (not force and state.get('hash') == tree_hash
+            and state.get('application_id') == bot.application_id):
+        logger.info("Command tree unchanged, skipping sync")
+        return None
+
+    synced = await bot.tree.sync()
+    AccountManager.save_db(COMMAND_TREE_DB, {
+        "hash": tree_hash,
+        "application_id": bot.application_id,
+        "synced_at": datetime.now().isoformat(),
+        "commands": len(synced)
+    })
+    logger.info(f"Synced {len(synced)} application commands")
+    return synced
+
+# Metrics endpoint
+@metrics.REGISTRY.add_collector
+def collect_runtime_metrics():
+    """Refresh stock and gateway gauges at scrape time"""
+    # Summed over the partitions currently in memory
+    levels = {}
+    for partition in AccountManager._partitions.values():
+        counts = AccountManager.get_stats_counts(partition.guild_id)
+        for service, tiers in counts["services"].items():
+            for tier, available in tiers.items():
+                levels[tier, service] = levels.get((tier, service), 0) + available
+    STOCK_LEVEL.clear()
+    for (tier, service), available in levels.items():
+        STOCK_LEVEL.set(available, tier=tier, service=service)
+
+    GATEWAY_LATENCY.clear()
+    for shard_id, latency in bot.latencies:
+        GATEWAY_LATENCY.set(latency, shard=shard_id)
+
+    PROCESS_RSS.set(get_rss_bytes())
+
+async def handle_metrics(request):
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return web.Response(body=body.encode(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+async def start_metrics_server():
+    """Serve /metrics for Prometheus scrapes"""
+    metrics_config = config.get('metrics', DEFAULT_CONFIG['metrics'])
+    if not metrics_config.get('enabled', True):
+        return
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/healthz', handle_healthz)
+    app.router.add_get('/readyz', handle_readyz)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    # Each cluster process gets its own port
+    port = metrics_config['port'] + bot.cluster_id
+    try:
+        site = web.TCPSite(runner, metrics_config['host'], port)
+        await site.start()
+        logger.info(f"Metrics available at http://{metrics_config['host']}:{port}/metrics")
+    except OSError as e:
+        logger.error(f"Failed to start metrics server: {e}")
+        await runner.cleanup()
+
+# Interaction trace recorder
+TRACE_FIELDS = ("time", "command", "tier", "service", "outcome", "user", "guild", "latency_ms")
+
+class TraceRecorder:
+    """Appends one compact JSON array per command invocation, in TRACE_FIELDS order.
+
+    User and guild ids are replaced by hashes keyed with the trace salt, so the
+    same user gets the same id across restarts and cluster processes and a
+    trace keeps per-user patterns without identifying anyone.
+    """
+
+    def __init__(self):
+        self._file = None
+        self._path = None
+
+    @staticmethod
+    def key():
+        """The hash key: trace.salt, or one derived from the bot token when no salt is set"""
+        salt = config.get('trace', DEFAULT_CONFIG['trace']).get('salt')
+        if salt:
+            return salt.encode()
+        return hashlib.sha256(f"trace\0{config.get('token', '')}".encode()).digest()
+
+    def anonymize(self, value):
+        if value is None:
+            return None
+        return hmac.new(self.key(), str(value).encode(), hashlib.sha256).hexdigest()[:12]
+
+    def record(self, ctx, elapsed):
+        settings = config.get('trace', DEFAULT_CONFIG['trace'])
+        if not settings['enabled']:
+            return
+        try:
+            if self._path != settings['path']:
+                if self._file:
+                    self._file.close()
+                self._file = open(settings['path'], 'a', buffering=1)
+                self._path = settings['path']
+            tier, outcome = ctx.profile.get("claim", (None, None))
+            self._file.write(json.dumps([
+                round(time.time(), 3),
+                ctx.command.qualified_name,
+                tier,
+                ctx.kwargs.get('service'),
+                outcome,
+                self.anonymize(ctx.author.id),
+                self.anonymize(ctx.guild.id if ctx.guild else None),
+                round(elapsed * 1000, 2)
+            ], separators=(',', ':')) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write trace to {settings['path']}: {e}")
+
+tracer = TraceRecorder()
+
+@bot.before_invoke
+async def start_command_timer(ctx: commands.Context):
+    ctx.profile = new_invoke_profile()
+    _invoke_profile.set(ctx.profile)
+    CommandProfiler.start(ctx)
+    ctx.command_started = time.perf_counter()
+
+@bot.after_invoke
+async def record_command_timer(ctx: commands.Context):
+    started = getattr(ctx, 'command_started', None)
+    if started is None:
+        return
+
+    elapsed = time.perf_counter() - started
+    COMMAND_LATENCY.observe(elapsed, command=ctx.command.qualified_name)
+    profile = CommandProfiler.stop(ctx)
+    _invoke_profile.set(None)
+    tracer.record(ctx, elapsed)
+
+    threshold_ms = config.get('profiling', DEFAULT_CONFIG['profiling'])['slow_command_ms']
+    if elapsed * 1000 < threshold_ms and profile is None:
+        return
+
+    entry = {
+        "time": datetime.now().isoformat(),
+        "source": "bot",
+        "command": ctx.command.qualified_name,
+        "user_id": ctx.author.id,
+        "guild_id": ctx.guild.id if ctx.guild else None,
+        "wall_ms": round(elapsed * 1000, 3),
+        "storage_ms": round(ctx.profile["storage_seconds"] * 1000, 3),
+        "storage_calls": ctx.profile["storage_calls"],
+        "bytes_read": ctx.profile["bytes_read"],
+        "bytes_serialized": ctx.profile["bytes_serialized"],
+        "slow": elapsed * 1000 >= threshold_ms
+    }
+    if profile:
+        entry.update(profile)
+    slow_logger.info(json.dumps(entry))
+
+# Event loop watchdog
+class LoopWatchdog:
+    """Measures event loop lag from a heartbeat and logs what a blocked loop is running.
+
+    The loop reschedules a heartbeat every `interval` seconds; a separate thread
+    notices when it stops arriving and logs the loop thread's current stack.
+    """
+    interval = 0.1
+
+    def __init__(self):
+        self.loop = None
+        self.loop_thread = None
+        self.last_beat = time.monotonic()
+        self.lag = 0.0
+        self.last_stall_at = None
+        self.last_stall_seconds = 0.0
+
+    def start(self, loop):
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        loop.call_soon(self._beat)
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def _beat(self):
+        now = time.monotonic()
+        self.lag = max(0.0, now - self.last_beat - self.interval)
+        LOOP_LAG.set(self.lag)
+        if self.lag >= config.get('health', DEFAULT_CONFIG['health'])['stall_seconds']:
+            self.last_stall_at = now
+            self.last_stall_seconds = self.lag
+        self.last_beat = now
+        self.loop.call_later(self.interval, self._beat)
+
+    def blocked_for(self):
+        """Seconds since the heartbeat was due"""
+        return max(0.0, time.monotonic() - self.last_beat - self.interval)
+
+    def _watch(self):
+        reported = False
+        while not self.loop.is_closed():
+            time.sleep(self.interval)
+            threshold = config.get('health', DEFAULT_CONFIG['health'])['stall_seconds']
+            if self.blocked_for() < threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            # One stack per stall, taken while the blocking callback is still running
+            reported = True
+            LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(no frame)"
+            logger.warning(f"Event loop blocked for over {threshold}s, currently running:\n{stack}")
+
+watchdog = LoopWatchdog()
+
+# Health checks
+# A probe stuck on the stock lock ties up this thread, not the default executor
+storage_probe_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage-probe')
+
+async def check_storage():
+    """Take the shared stock lock and refresh, within the storage timeout"""
+    timeout = config.get('health', DEFAULT_CONFIG['health'])['storage_timeout']
+    pending = getattr(check_storage, 'pending', None)
+    if pending is not None and not pending.done():
+        return {"ok": False, "error": "previous storage probe is still pending"}
+
+    started = time.perf_counter()
+    probe = check_storage.pending = asyncio.get_running_loop().run_in_executor(
+        storage_probe_pool, AccountManager.get_stock
+    )
+    try:
+        # Shielded so a timeout leaves the probe pending until its thread returns
+        await asyncio.wait_for(asyncio.shield(probe), timeout)
+    except asyncio.TimeoutError:
+        return {"ok": False, "error": f"stock store did not respond within {timeout}s"}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "seconds": round(time.perf_counter() - started, 4)}
+
+def check_gateway():
+    """Every shard connected with a recent heartbeat"""
+    limit = config.get('health', DEFAULT_CONFIG['health'])['max_gateway_latency']
+    shards = {}
+    for shard_id, latency in bot.latencies:
+        shard = bot.get_shard(shard_id)
+        healthy = (shard is not None and not shard.is_closed()
+                   and math.isfinite(latency) and latency <= limit)
+        shards[str(shard_id)] = {
+            "ok": healthy,
+            "latency": round(latency, 4) if math.isfinite(latency) else None
+        }
+    ok = bot.is_ready() and not bot.is_closed() and bool(shards) and all(s["ok"] for s in shards.values())
+    return {"ok": ok, "ready": bot.is_ready(), "shards": shards}
+
+def check_loop():
+    """No stall past the unhealthy threshold within the recent window"""
+    health = config.get('health', DEFAULT_CONFIG['health'])
+    recent = (watchdog.last_stall_at is not None
+              and time.monotonic() - watchdog.last_stall_at <= health['unhealthy_window_seconds'])
+    ok = not (recent and watchdog.last_stall_seconds >= health['unhealthy_lag_seconds'])
+    return {
+        "ok": ok,
+        "lag": round(watchdog.lag, 4),
+        "last_stall_seconds": round(watchdog.last_stall_seconds, 4) if recent else None
+    }
+
+async def handle_healthz(request):
+    """Liveness: the loop is responsive and storage answers"""
+    checks = {"loop": check_loop(), "storage": await check_storage()}
+    ok = all(check["ok"] for check in checks.values())
+    return web.json_response({"ok": ok, "checks": checks}, status=200 if ok else 503)
+
+async def handle_readyz(request):
+    """Readiness: live, and every shard is connected to the gateway"""
+    checks = {"loop": check_loop(), "storage": await check_storage(), "gateway": check_gateway()}
+    ok = all(check["ok"] for check in checks.values())
+    return web.json_response({"ok": ok, "checks": checks}, status=200 if ok else 503)
+
 # Background tasks
+@tasks.loop(seconds=30)
+async def check_gateway_latency():
+    """Warn about shards whose heartbeat latency is over the limit"""
+    limit = config.get('health', DEFAULT_CONFIG['health'])['max_gateway_latency']
+    for shard_id, latency in bot.latencies:
+        if not math.isfinite(latency) or latency > limit:
+            logger.warning(f"Shard {shard_id} heartbeat latency is {latency:.2f}s (limit {limit}s)")
+
+@tasks.loop(minutes=1)
+async def compact_stock_log():
+    """Fold each loaded partition's stock log into a new snapshot once it grows large"""
+    threshold = config.get('storage', DEFAULT_CONFIG['storage'])['compact_log_bytes']
+    for partition in AccountManager._partitions.values():
+        store = partition.stock
+        if store.log_size() < threshold:
+            continue
+        try:
+            await asyncio.to_thread(store.compact)
+            logger.info(f"Compacted {store.log_path} into {store.snapshot_path}")
+        except Exception as e:
+            logger.error(f"Failed to compact {store.log_path}: {e}", exc_info=True)
+
+@tasks.loop(seconds=10)
+async def release_drops():
+    """Release scheduled drop waves that are due"""
+    try:
+        # Off the event loop; it waits on the drops and stock locks while the panel imports or edits stock
+        for drop_id, released in await asyncio.to_thread(AccountManager.release_due_drops):
+            logger.info(f"Released {released} accounts from drop {drop_id}")
+    except Exception as e:
+        logger.error(f"Failed to release drops: {e}", exc_info=True)
+
 @tasks.loop(minutes=5)
 async def rotate_status():
     """Rotate the bot's status message"""
@@ -284,6 +1114,15 @@ async def on_ready():
     logger.info(f'Logged in as {bot.user} (ID: {bot.user.id})')
     logger.info(f'Connected to {len(bot.guilds)} guilds')
     logger.info(f'Running {bot.shard_count} shard(s)')
+
+    if not hasattr(bot, 'startup_seconds'):
+        bot.startup_seconds = time.monotonic() - PROCESS_STARTED
+        STARTUP_TIME.set(bot.startup_seconds)
+    mode = "lean" if config.get('lean_gateway', DEFAULT_CONFIG['lean_gateway']) else "full"
+    logger.info(
+        f'Gateway mode: {mode}, ready after {bot.startup_seconds:.1f}s, '
+        f'RSS {get_rss_bytes() / 1024 / 1024:.1f} MiB, {len(bot.users)} cached users'
+    )
     
     # Start background tasks
     rotate_status.start()
@@ -299,9 +1138,14 @@ async def on_ready():
 async def generate(ctx: commands.Context, service: Optional[str] = None):
     """Generate a free account"""
     try:
-        # Check cooldown
-        cooldown = AccountManager.check_cooldown(ctx.author.id, "free")
-        if cooldown:
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
+        key = claim_key_of(ctx)
+
+        # Check cooldown; a retried invocation already set it and gets its original account below
+        cooldown = await asyncio.to_thread(AccountManager.check_cooldown, ctx.author.id, "free", guild_id)
+        if cooldown and not await asyncio.to_thread(AccountManager.get_claimed_account, key, guild_id):
+            count_claim("free", "cooldown")
             hours, remainder = divmod(int(cooldown.total_seconds()), 3600)
             minutes, seconds = divmod(remainder, 60)
             await ctx.send(
@@ -311,8 +1155,12 @@ async def generate(ctx: commands.Context, service: Optional[str] = None):
             return
             
         # Get account
-        account = AccountManager.get_random_account("free", service)
+        # Off the event loop; the claim waits on the stock lock while bulk edits hold it
+        account = await asyncio.to_thread(
+            AccountManager.get_random_account, "free", service, ctx.author.id, guild_id, key
+        )
         if not account:
+            count_claim("free", "empty")
             await ctx.send(
                 "Sorry, we're out of free accounts right now!" + 
                 (f" (for {service})" if service else ""),
@@ -335,11 +1183,20 @@ async def generate(ctx: commands.Context, service: Optional[str] = None):
             await ctx.author.send(embed=embed)
             await ctx.send("Check your DMs for your account!", ephemeral=True)
             
-            # Update cooldown and stats
-            AccountManager.update_cooldown(ctx.author.id, "free")
-            AccountManager.update_stat("free_generated")
+            # Update cooldown and stats once, unless this retry completes a failed delivery
+            if account.get("replayed") and account["delivered"]:
+                count_claim("free", "replayed")
+            else:
+                if account.get("replayed"):
+                    await asyncio.to_thread(AccountManager.mark_claim_delivered, key, True, guild_id)
+                await asyncio.to_thread(AccountManager.update_cooldown, ctx.author.id, "free", guild_id)
+                await asyncio.to_thread(AccountManager.update_stat, "free_generated", guild_id=guild_id)
+                count_claim("free", "success")
             
         except discord.Forbidden:
+            count_claim("free", "forbidden")
+            if not account.get("replayed"):
+                await asyncio.to_thread(AccountManager.mark_claim_delivered, key, False, guild_id)
             await ctx.send("I couldn't DM you. Please enable DMs from server members!", ephemeral=True)
     except Exception as e:
         logger.error(f"Error in generate command: {e}", exc_info=True)
@@ -351,24 +1208,26 @@ async def generate(ctx: commands.Context, service: Optional[str] = None):
 async def premium(ctx: commands.Context, service: Optional[str] = None):
     """Generate a premium account"""
     try:
-        config = AccountManager.load_db(CONFIG_FILE, DEFAULT_CONFIG)
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
         
         # Check if user has premium role
-        has_premium = any(
-            role.name in config['premium_roles'] 
-            for role in ctx.author.roles
-        )
+        has_premium = has_any_role(ctx.author, config['premium_roles'])
         
         if not has_premium:
+            count_claim("premium", "no_role")
             await ctx.send(
                 "You need a premium role to use this command!",
                 ephemeral=True
             )
             return
             
-        # Check cooldown
-        cooldown = AccountManager.check_cooldown(ctx.author.id, "premium")
-        if cooldown:
+        key = claim_key_of(ctx)
+
+        # Check cooldown; a retried invocation already set it and gets its original account below
+        cooldown = await asyncio.to_thread(AccountManager.check_cooldown, ctx.author.id, "premium", guild_id)
+        if cooldown and not await asyncio.to_thread(AccountManager.get_claimed_account, key, guild_id):
+            count_claim("premium", "cooldown")
             hours, remainder = divmod(int(cooldown.total_seconds()), 3600)
             minutes, seconds = divmod(remainder, 60)
             await ctx.send(
@@ -378,8 +1237,12 @@ async def premium(ctx: commands.Context, service: Optional[str] = None):
             return
             
         # Get account
-        account = AccountManager.get_random_account("premium", service)
+        # Off the event loop; the claim waits on the stock lock while bulk edits hold it
+        account = await asyncio.to_thread(
+            AccountManager.get_random_account, "premium", service, ctx.author.id, guild_id, key
+        )
         if not account:
+            count_claim("premium", "empty")
             await ctx.send(
                 "Sorry, we're out of premium accounts right now!" + 
                 (f" (for {service})" if service else ""),
@@ -402,11 +1265,20 @@ async def premium(ctx: commands.Context, service: Optional[str] = None):
             await ctx.author.send(embed=embed)
             await ctx.send("Check your DMs for your premium account!", ephemeral=True)
             
-            # Update cooldown and stats
-            AccountManager.update_cooldown(ctx.author.id, "premium")
-            AccountManager.update_stat("premium_generated")
+            # Update cooldown and stats once, unless this retry completes a failed delivery
+            if account.get("replayed") and account["delivered"]:
+                count_claim("premium", "replayed")
+            else:
+                if account.get("replayed"):
+                    await asyncio.to_thread(AccountManager.mark_claim_delivered, key, True, guild_id)
+                await asyncio.to_thread(AccountManager.update_cooldown, ctx.author.id, "premium", guild_id)
+                await asyncio.to_thread(AccountManager.update_stat, "premium_generated", guild_id=guild_id)
+                count_claim("premium", "success")
             
         except discord.Forbidden:
+            count_claim("premium", "forbidden")
+            if not account.get("replayed"):
+                await asyncio.to_thread(AccountManager.mark_claim_delivered, key, False, guild_id)
             await ctx.send("I couldn't DM you. Please enable DMs from server members!", ephemeral=True)
     except Exception as e:
         logger.error(f"Error in premium command: {e}", exc_info=True)
@@ -417,8 +1289,10 @@ async def premium(ctx: commands.Context, service: Optional[str] = None):
 async def services(ctx: commands.Context):
     """List available services"""
     try:
-        free_services = AccountManager.get_services("free")
-        premium_services = AccountManager.get_services("premium")
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
+        free_services = AccountManager.get_services("free", guild_id)
+        premium_services = AccountManager.get_services("premium", guild_id)
         
         embed = discord.Embed(
             title="Available Services",
@@ -462,8 +1336,10 @@ async def services(ctx: commands.Context):
 async def stats(ctx: commands.Context):
     """Show account statistics"""
     try:
-        stats = AccountManager.get_stats_counts()
-        total_stats = AccountManager.get_stats()
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
+        stats = AccountManager.get_stats_counts(guild_id)
+        total_stats = AccountManager.get_stats(guild_id)
         
         embed = discord.Embed(
             title="Account Statistics",
@@ -489,6 +1365,23 @@ async def stats(ctx: commands.Context):
             inline=False
         )
         
+        # Claim trend over the last day, from the rollups
+        trends = AccountManager.get_claim_trends(guild_id)
+        if trends:
+            trend_text = []
+            for trend in trends[:5]:
+                eta = f"{trend['eta_hours']:.0f}h" if trend['eta_hours'] < 72 else f"{trend['eta_hours'] / 24:.0f}d"
+                trend_text.append(
+                    f"**{trend['service']}** ({trend['tier']}): {trend['last_day']} claims, "
+                    f"{trend['per_hour']:.1f}/h, runs out in ~{eta}"
+                )
+            claims_last_hour = sum(trend['last_hour'] for trend in trends)
+            embed.add_field(
+                name=f"Trend (24h) - {claims_last_hour} claims in the last hour",
+                value="\n".join(trend_text),
+                inline=False
+            )
+
         # Add service breakdown if there are services
         if stats['services']:
             service_text = []
@@ -523,10 +1416,11 @@ async def addaccounts(
 ):
     """Add accounts to the database (Admin only)"""
     try:
-        config = AccountManager.load_db(CONFIG_FILE, DEFAULT_CONFIG)
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
         
         # Check permissions
-        if not any(role.name in config['admin_roles'] for role in ctx.author.roles):
+        if not has_any_role(ctx.author, config['admin_roles']):
             await ctx.send("You don't have permission to use this command.", ephemeral=True)
             return
             
@@ -551,11 +1445,8 @@ async def addaccounts(
                 return
                 
             # Add to database
-            added = 0
-            for acc in accounts_list:
-                if AccountManager.add_account(account_type.lower(), service, acc):
-                    added += 1
-                    
+            added = AccountManager.add_accounts(account_type.lower(), service, accounts_list, guild_id)
+
             if added > 0:
                 await ctx.send(
                     f"Successfully added {added} {account_type} accounts for {service}!",
@@ -571,12 +1462,557 @@ async def addaccounts(
         logger.error(f"Error in addaccounts command: {e}", exc_info=True)
         await ctx.send("An error occurred while adding accounts.", ephemeral=True)
 
+# Command: Schedule a stock drop (Admin only)
+@bot.hybrid_command(name="scheduledrop", description="Stage accounts now and release them later (Admin only)")
+@app_commands.describe(
+    account_type="Type of accounts (free/premium)",
+    service="Service name",
+    accounts="Text file with accounts (one per line)",
+    release_at="Release time (YYYY-MM-DD HH:MM, server time)",
+    wave_size="Accounts per wave (default: all at once)",
+    interval_minutes="Minutes between waves"
+)
+async def scheduledrop(
+    ctx: commands.Context,
+    account_type: str,
+    service: str,
+    accounts: discord.Attachment,
+    release_at: str,
+    wave_size: Optional[int] = None,
+    interval_minutes: int = 10
+):
+    """Stage accounts now and release them later (Admin only)"""
+    try:
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        if account_type.lower() not in ("free", "premium"):
+            await ctx.send("Account type must be either 'free' or 'premium'.", ephemeral=True)
+            return
+
+        if not accounts.filename.endswith('.txt'):
+            await ctx.send("Please upload a .txt file with one account per line.", ephemeral=True)
+            return
+
+        try:
+            release_time = datetime.fromisoformat(release_at)
+        except ValueError:
+            await ctx.send("Release time must be in YYYY-MM-DD HH:MM format.", ephemeral=True)
+            return
+
+        if (wave_size is not None and wave_size < 1) or interval_minutes < 0:
+            await ctx.send("Wave size must be positive and the interval can't be negative.", ephemeral=True)
+            return
+
+        await ctx.defer(ephemeral=True)
+
+        content = await accounts.read()
+        accounts_list = [acc.strip() for acc in content.decode('utf-8').splitlines() if acc.strip()]
+        if not accounts_list:
+            await ctx.send("The file doesn't contain any valid accounts.", ephemeral=True)
+            return
+
+        waves = plan_waves(len(accounts_list), release_time.timestamp(), wave_size, interval_minutes * 60)
+        drop_id = await asyncio.to_thread(
+            AccountManager.stage_drop, account_type.lower(), service, accounts_list, waves, guild_id
+        )
+        if not drop_id:
+            await ctx.send("Failed to stage the drop.", ephemeral=True)
+            return
+
+        logger.info(f"{ctx.author} staged drop {drop_id}: {len(accounts_list)} {account_type} {service} in {len(waves)} wave(s)")
+        await ctx.send(
+            f"Staged drop `{drop_id}`: {len(accounts_list)} {account_type} accounts for {service}, "
+            f"released from {release_time:%Y-%m-%d %H:%M} in {len(waves)} wave(s).",
+            ephemeral=True
+        )
+    except Exception as e:
+        logger.error(f"Error in scheduledrop command: {e}", exc_info=True)
+        await ctx.send("An error occurred while staging the drop.", ephemeral=True)
+
+# Command: List or release scheduled drops (Admin only)
+@bot.hybrid_command(name="drops", description="List scheduled drops or release one now (Admin only)")
+@app_commands.describe(release="Drop id to release immediately")
+async def drops(ctx: commands.Context, release: Optional[str] = None):
+    """List scheduled drops or release one now (Admin only)"""
+    try:
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        partition_id = AccountManager.partition(guild_id).guild_id
+        pending = {
+            drop_id: drop for drop_id, drop in (await asyncio.to_thread(AccountManager.get_drops)).items()
+            if drop["guild_id"] == partition_id
+        }
+
+        if release:
+            if release not in pending:
+                await ctx.send(f"No pending drop `{release}`.", ephemeral=True)
+                return
+            released = await asyncio.to_thread(AccountManager.release_drop_now, release)
+            logger.info(f"{ctx.author} released drop {release} early ({released} accounts)")
+            await ctx.send(f"Released {released} accounts from drop `{release}`.", ephemeral=True)
+            return
+
+        embed = discord.Embed(
+            title="Scheduled Drops",
+            color=config['embed_color'],
+            timestamp=datetime.now()
+        )
+        if not pending:
+            embed.description = "No drops scheduled."
+        for drop_id, drop in pending.items():
+            upcoming = [release_at for release_at, _ in drop["waves"] if release_at > time.time()]
+            next_wave = f"<t:{upcoming[0]}:R>" if upcoming else "now"
+            embed.add_field(
+                name=f"{drop_id} - {drop['service']} ({drop['tier']})",
+                value=(
+                    f"Released {drop['released']}/{drop['items']} in {len(drop['waves'])} wave(s)\n"
+                    f"Next wave: {next_wave}"
+                ),
+                inline=False
+            )
+        await ctx.send(embed=embed, ephemeral=True)
+    except Exception as e:
+        logger.error(f"Error in drops command: {e}", exc_info=True)
+        await ctx.send("An error occurred while fetching drops.", ephemeral=True)
+
+# Bulk stock operations (Admin only)
+async def run_bulk_update(ctx, record, dry_run, verb):
+    """Run a bulk record off the event loop and report how many accounts it touched"""
+    await ctx.defer(ephemeral=True)
+    count = await asyncio.to_thread(AccountManager.bulk_update, record, dry_run, guild_id_of(ctx))
+    if dry_run:
+        await ctx.send(f"Dry run: would {verb} {count} accounts.", ephemeral=True)
+        return
+    logger.info(f"{ctx.author} ran {record['op']} on {count} accounts: {record}")
+    await ctx.send(f"{verb.capitalize()}d {count} accounts.", ephemeral=True)
+
+# Command: Purge accounts by service or pattern (Admin only)
+@bot.hybrid_command(name="purge", description="Delete accounts by service or pattern (Admin only)")
+@app_commands.describe(
+    account_type="Type of accounts (free/premium)",
+    service="Only this service (default: all services)",
+    pattern="Only credentials matching this pattern, e.g. *@baddomain.com:*",
+    dry_run="Only count the accounts that would be deleted"
+)
+async def purge(
+    ctx: commands.Context,
+    account_type: str,
+    service: Optional[str] = None,
+    pattern: Optional[str] = None,
+    dry_run: bool = False
+):
+    """Delete accounts by service or pattern (Admin only)"""
+    try:
+        config = AccountManager.get_config(guild_id_of(ctx))
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        account_type = account_type.lower()
+        if account_type not in ("free", "premium"):
+            await ctx.send("Account type must be either 'free' or 'premium'.", ephemeral=True)
+            return
+
+        if not service and not pattern:
+            await ctx.send("Give a service, a pattern or both.", ephemeral=True)
+            return
+
+        record = {"op": "purge", "tier": account_type, "service": service, "pattern": pattern}
+        await run_bulk_update(ctx, record, dry_run, "purge")
+    except Exception as e:
+        logger.error(f"Error in purge command: {e}", exc_info=True)
+        await ctx.send("An error occurred while purging accounts.", ephemeral=True)
+
+# Command: Return claimed accounts to the pool (Admin only)
+@bot.hybrid_command(name="requeue", description="Return accounts claimed since a time to the pool (Admin only)")
+@app_commands.describe(
+    since="Requeue claims at or after this time (YYYY-MM-DD HH:MM, server time)",
+    account_type="Only this type (free/premium)",
+    service="Only this service",
+    dry_run="Only count the accounts that would be requeued"
+)
+async def requeue(
+    ctx: commands.Context,
+    since: str,
+    account_type: Optional[str] = None,
+    service: Optional[str] = None,
+    dry_run: bool = False
+):
+    """Return accounts claimed since a time to the pool (Admin only)"""
+    try:
+        config = AccountManager.get_config(guild_id_of(ctx))
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        if account_type and account_type.lower() not in ("free", "premium"):
+            await ctx.send("Account type must be either 'free' or 'premium'.", ephemeral=True)
+            return
+
+        try:
+            since_time = datetime.fromisoformat(since)
+        except ValueError:
+            await ctx.send("Time must be in YYYY-MM-DD HH:MM format.", ephemeral=True)
+            return
+
+        record = {
+            "op": "requeue",
+            "tier": account_type.lower() if account_type else None,
+            "service": service,
+            "since": int(since_time.timestamp())
+        }
+        await run_bulk_update(ctx, record, dry_run, "requeue")
+    except Exception as e:
+        logger.error(f"Error in requeue command: {e}", exc_info=True)
+        await ctx.send("An error occurred while requeueing accounts.", ephemeral=True)
+
+# Command: Move accounts between tiers (Admin only)
+@bot.hybrid_command(name="movetier", description="Move a service's accounts to the other tier (Admin only)")
+@app_commands.describe(
+    account_type="Tier to move from (free/premium)",
+    service="Service name",
+    to_type="Tier to move to (free/premium)",
+    pattern="Only credentials matching this pattern",
+    dry_run="Only count the accounts that would be moved"
+)
+async def movetier(
+    ctx: commands.Context,
+    account_type: str,
+    service: str,
+    to_type: str,
+    pattern: Optional[str] = None,
+    dry_run: bool = False
+):
+    """Move a service's accounts to the other tier (Admin only)"""
+    try:
+        config = AccountManager.get_config(guild_id_of(ctx))
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        account_type, to_type = account_type.lower(), to_type.lower()
+        if account_type not in ("free", "premium") or to_type not in ("free", "premium"):
+            await ctx.send("Account types must be either 'free' or 'premium'.", ephemeral=True)
+            return
+
+        if account_type == to_type:
+            await ctx.send("The accounts are already in that tier.", ephemeral=True)
+            return
+
+        record = {"op": "move", "tier": account_type, "service": service, "to": to_type, "pattern": pattern}
+        await run_bulk_update(ctx, record, dry_run, "move")
+    except Exception as e:
+        logger.error(f"Error in movetier command: {e}", exc_info=True)
+        await ctx.send("An error occurred while moving accounts.", ephemeral=True)
+
+# Command: Claim many accounts at once (Admin only)
+@bot.hybrid_command(name="batchclaim", description="Pull many accounts at once as one file (Admin only)")
+@app_commands.describe(
+    account_type="Type of accounts (free/premium)",
+    count="Number of accounts to pull",
+    services="Comma-separated services to pull from (default: all)",
+    member="DM the file to this member instead of you, e.g. a giveaway winner"
+)
+async def batchclaim(
+    ctx: commands.Context,
+    account_type: str,
+    count: int,
+    services: Optional[str] = None,
+    member: Optional[discord.Member] = None
+):
+    """Pull many accounts at once as one file (Admin only)"""
+    try:
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        account_type = account_type.lower()
+        if account_type not in ("free", "premium"):
+            await ctx.send("Account type must be either 'free' or 'premium'.", ephemeral=True)
+            return
+
+        limit = config.get('batch_claim_max', DEFAULT_CONFIG['batch_claim_max'])
+        if not 1 <= count <= limit:
+            await ctx.send(f"Count must be between 1 and {limit}.", ephemeral=True)
+            return
+
+        await ctx.defer(ephemeral=True)
+
+        service_list = [s.strip() for s in services.split(",") if s.strip()] if services else None
+        recipient = member or ctx.author
+        items = await asyncio.to_thread(
+            AccountManager.claim_batch, account_type, count, service_list, recipient.id, guild_id, claim_key_of(ctx)
+        )
+        if items is None:
+            await ctx.send(
+                f"Not enough {account_type} accounts" + (f" in {services}" if services else "") +
+                f" to pull {count}. Nothing was claimed.",
+                ephemeral=True
+            )
+            return
+
+        logger.info(f"{ctx.author} pulled {len(items)} {account_type} accounts for {recipient}")
+        content = "".join(f"{item['service']} | {item['credentials']}\n" for item in items)
+        filename = f"{account_type}-accounts-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+
+        def attachment():
+            return discord.File(io.BytesIO(content.encode('utf-8')), filename=filename)
+
+        if member:
+            try:
+                await member.send(f"Here are your {len(items)} {account_type} accounts!", file=attachment())
+                await ctx.send(f"Sent {len(items)} accounts to {member.mention}.", ephemeral=True)
+                return
+            except discord.Forbidden:
+                # The accounts are already claimed, so hand them to the admin instead
+                await ctx.send(
+                    f"I couldn't DM {member.mention}; here are the {len(items)} accounts instead.",
+                    file=attachment(),
+                    ephemeral=True
+                )
+                return
+
+        await ctx.send(f"Pulled {len(items)} {account_type} accounts.", file=attachment(), ephemeral=True)
+    except Exception as e:
+        logger.error(f"Error in batchclaim command: {e}", exc_info=True)
+        await ctx.send("An error occurred while pulling accounts.", ephemeral=True)
+
+# Command: Export stock and claim history (Admin only)
+@bot.hybrid_command(name="export", description="Export stock and claim history (Admin only)")
+@app_commands.describe(
+    fmt="Export format (ndjson/csv)",
+    account_type="Only export this type (free/premium)",
+    service="Only export this service",
+    status="Only export available or used accounts",
+    since="Only claims at or after this date (YYYY-MM-DD)",
+    until="Only claims before this date (YYYY-MM-DD)"
+)
+async def export(
+    ctx: commands.Context,
+    fmt: str = "ndjson",
+    account_type: Optional[str] = None,
+    service: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """Export stock and claim history (Admin only)"""
+    try:
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        fmt = fmt.lower()
+        if fmt not in ("ndjson", "csv"):
+            await ctx.send("Format must be either 'ndjson' or 'csv'.", ephemeral=True)
+            return
+
+        if account_type and account_type.lower() not in ("free", "premium"):
+            await ctx.send("Account type must be either 'free' or 'premium'.", ephemeral=True)
+            return
+
+        if status and status.lower() not in ("available", "used"):
+            await ctx.send("Status must be either 'available' or 'used'.", ephemeral=True)
+            return
+
+        try:
+            since_dt = datetime.fromisoformat(since) if since else None
+            until_dt = datetime.fromisoformat(until) if until else None
+        except ValueError:
+            await ctx.send("Dates must be in YYYY-MM-DD format.", ephemeral=True)
+            return
+
+        await ctx.defer(ephemeral=True)
+
+        rows = iter_export_rows(
+            AccountManager.get_stock(guild_id),
+            account_type.lower() if account_type else None,
+            service,
+            status.lower() if status else None,
+            since_dt,
+            until_dt
+        )
+
+        # Stream to a temporary file so large exports never sit in memory
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+        try:
+            def write_export():
+                with os.fdopen(fd, 'w', newline='') as f:
+                    for line in iter_export_lines(rows, fmt):
+                        f.write(line)
+
+            await asyncio.to_thread(write_export)
+            filename = f"export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+            await ctx.send(file=discord.File(path, filename=filename), ephemeral=True)
+        finally:
+            os.remove(path)
+    except discord.HTTPException as e:
+        logger.error(f"Failed to upload export: {e}")
+        await ctx.send("The export is too large to upload. Use the web panel export instead.", ephemeral=True)
+    except Exception as e:
+        logger.error(f"Error in export command: {e}", exc_info=True)
+        await ctx.send("An error occurred while exporting accounts.", ephemeral=True)
+
+# Command: Toggle the command profiler (Admin only)
+@bot.hybrid_command(name="profiler", description="Toggle the command profiler (Admin only)")
+@app_commands.describe(
+    mode="Profiler to use (cprofile/tracemalloc/off)",
+    sample_rate="Fraction of commands to profile (0-1)"
+)
+async def profiler(ctx: commands.Context, mode: str, sample_rate: float = 0.1):
+    """Toggle the command profiler (Admin only)"""
+    try:
+        config = AccountManager.load_db(CONFIG_FILE, DEFAULT_CONFIG)
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        mode = mode.lower()
+        if mode not in ("cprofile", "tracemalloc", "off"):
+            await ctx.send("Mode must be 'cprofile', 'tracemalloc' or 'off'.", ephemeral=True)
+            return
+
+        if mode == "off":
+            CommandProfiler.disable()
+            await ctx.send("Profiler disabled.", ephemeral=True)
+            return
+
+        if not 0 < sample_rate <= 1:
+            await ctx.send("Sample rate must be between 0 and 1.", ephemeral=True)
+            return
+
+        CommandProfiler.enable(mode, sample_rate)
+        logger.info(f"Profiler enabled by {ctx.author}: {mode} at {sample_rate:.0%}")
+        await ctx.send(
+            f"Profiler enabled: {mode}, sampling {sample_rate:.0%} of commands. Results go to slow.log.",
+            ephemeral=True
+        )
+    except Exception as e:
+        logger.error(f"Error in profiler command: {e}", exc_info=True)
+        await ctx.send("An error occurred while toggling the profiler.", ephemeral=True)
+
+# Command: Force a command tree sync (Admin only)
+@bot.hybrid_command(name="synccommands", description="Force a slash command sync (Admin only)")
+async def synccommands(ctx: commands.Context):
+    """Force a slash command sync (Admin only)"""
+    try:
+        config = AccountManager.load_db(CONFIG_FILE, DEFAULT_CONFIG)
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        await ctx.defer(ephemeral=True)
+        synced = await sync_command_tree(force=True)
+        await ctx.send(f"Synced {len(synced)} slash commands.", ephemeral=True)
+    except discord.HTTPException as e:
+        logger.error(f"Command sync failed: {e}")
+        await ctx.send("Discord rejected the sync. Try again later.", ephemeral=True)
+    except Exception as e:
+        logger.error(f"Error in synccommands command: {e}", exc_info=True)
+        await ctx.send("An error occurred while syncing commands.", ephemeral=True)
+
+# Command: Per-guild settings (Admin only)
+GUILD_SETTINGS = {
+    "free_cooldown": ("cooldown", "free"),
+    "premium_cooldown": ("cooldown", "premium"),
+    "admin_roles": ("admin_roles", None),
+    "premium_roles": ("premium_roles", None),
+    "embed_color": ("embed_color", None),
+    "log_channel": ("log_channel", None)
+}
+
+@bot.hybrid_command(name="guildconfig", description="Override a setting for this server (Admin only)")
+@app_commands.describe(
+    setting="free_cooldown, premium_cooldown, admin_roles, premium_roles, embed_color or log_channel",
+    value="New value (seconds, comma-separated role names, #RRGGBB or channel id); leave empty to reset"
+)
+async def guildconfig(ctx: commands.Context, setting: str, value: Optional[str] = None):
+    """Override a setting for this server (Admin only)"""
+    try:
+        guild_id = guild_id_of(ctx)
+        config = AccountManager.get_config(guild_id)
+
+        # Check permissions
+        if not has_any_role(ctx.author, config['admin_roles']):
+            await ctx.send("You don't have permission to use this command.", ephemeral=True)
+            return
+
+        if not guild_id or not config.get('partitions', DEFAULT_CONFIG['partitions'])['by_guild']:
+            await ctx.send("Per-server settings are disabled (partitions.by_guild in config.json).", ephemeral=True)
+            return
+
+        setting = setting.lower()
+        if setting not in GUILD_SETTINGS:
+            await ctx.send(f"Setting must be one of: {', '.join(GUILD_SETTINGS)}.", ephemeral=True)
+            return
+
+        parsed = None
+        if value:
+            try:
+                if setting.endswith("_cooldown"):
+                    parsed = int(value)
+                    if parsed < 0:
+                        raise ValueError(value)
+                elif setting.endswith("_roles"):
+                    parsed = [name.strip() for name in value.split(",") if name.strip()]
+                elif setting == "embed_color":
+                    parsed = int(value.lstrip("#"), 16)
+                else:
+                    parsed = int(value)
+            except ValueError:
+                await ctx.send(f"Invalid value for {setting}.", ephemeral=True)
+                return
+
+        key, subkey = GUILD_SETTINGS[setting]
+        if not AccountManager.set_guild_config(guild_id, key, parsed, subkey):
+            await ctx.send("Failed to save the setting.", ephemeral=True)
+            return
+
+        logger.info(f"{ctx.author} set {setting} for guild {guild_id} to {parsed!r}")
+        if parsed is None:
+            await ctx.send(f"Reset {setting} to the global default.", ephemeral=True)
+        else:
+            await ctx.send(f"Set {setting} for this server.", ephemeral=True)
+    except Exception as e:
+        logger.error(f"Error in guildconfig command: {e}", exc_info=True)
+        await ctx.send("An error occurred while saving the setting.", ephemeral=True)
+
 # Command: Help
 @bot.hybrid_command(name="help", description="Show help information")
 async def help_command(ctx: commands.Context):
     """Show help information"""
     try:
-        config = AccountManager.load_db(CONFIG_FILE, DEFAULT_CONFIG)
+        config = AccountManager.get_config(guild_id_of(ctx))
         
         embed = discord.Embed(
             title="Account Generator Help",
@@ -598,11 +2034,21 @@ async def help_command(ctx: commands.Context):
         )
         
         # Admin commands
-        if any(role.name in config['admin_roles'] for role in ctx.author.roles):
+        if has_any_role(ctx.author, config['admin_roles']):
             embed.add_field(
                 name="Admin Commands",
                 value=(
                     "`/addaccounts <type> <service> <file>` - Add accounts to the database\n"
+                    "`/scheduledrop <type> <service> <file> <release_at> [wave_size] [interval]` - Stage a timed drop\n"
+                    "`/drops [release]` - List scheduled drops or release one now\n"
+                    "`/batchclaim <type> <count> [services] [member]` - Pull many accounts at once as one file\n"
+                    "`/purge <type> [service] [pattern] [dry_run]` - Delete accounts by service or pattern\n"
+                    "`/requeue <since> [type] [service] [dry_run]` - Return accounts claimed since a time to the pool\n"
+                    "`/movetier <type> <service> <to_type> [pattern] [dry_run]` - Move accounts to the other tier\n"
+                    "`/export [format] [type] [service] [status] [since] [until]` - Export stock and claim history\n"
+                    "`/profiler <cprofile|tracemalloc|off> [sample_rate]` - Sample command profiles into slow.log\n"
+                    "`/synccommands` - Force a slash command sync\n"
+                    "`/guildconfig <setting> [value]` - Override a setting for this server\n"
                 ),
                 inline=False
             )
@@ -613,6 +2059,14 @@ async def help_command(ctx: commands.Context):
         logger.error(f"Error in help command: {e}", exc_info=True)
         await ctx.send("An error occurred while displaying help.", ephemeral=True)
 
+def run_cluster(cluster_id, shard_ids, shard_count):
+    """Run this process as one cluster of shards (see cluster.py)"""
+    bot.cluster_id = cluster_id
+    bot.shard_ids = list(shard_ids)
+    bot.shard_count = shard_count
+    logger.info(f"Starting cluster {cluster_id} with shards {bot.shard_ids} of {shard_count}")
+    bot.run(config['token'])
+
 if __name__ == '__main__':
     try:
         bot.run(config['token'])
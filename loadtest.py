@@ -0,0 +1,315 @@
+"""Offline load test for the bot's commands, no Discord connection required.
+
+Simulated users call /generate, /premium and /stats through fake command
+contexts. Each process drives the real command callbacks against a shared
+scratch copy of the databases.
+
+Usage:
+    python loadtest.py --users 5000 --stock 20000                   # Poisson arrivals
+    python loadtest.py --users 5000 --pattern burst --processes 4   # a stock drop hitting 4 bot processes
+
+The report lists throughput, p50/p99 latency per command, outcome counts,
+double claims (one item delivered to two users) and lost writes (delivered
+items that are not marked used, or stats that do not add up). With
+--duplicate-rate, some invocations are delivered twice with the same
+interaction id; those must return the original item without a second claim.
+A retry that arrives while the original is still sending its DM, which then
+fails, delivers the item without counting it, so a few stat writes may show
+as lost at high duplicate and DM failure rates.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COMMAND_MIX = (("generate", 0.6), ("premium", 0.25), ("stats", 0.15))
+
+
+class FakeRole:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeAuthor:
+    """Stands in for a guild member; DMs are recorded per invocation instead of sent"""
+
+    def __init__(self, discord, user_id, roles, dm_failure_rate, latency):
+        self.discord = discord
+        self.id = user_id
+        self.roles = roles
+        self.dm_failure_rate = dm_failure_rate
+        self.latency = latency
+        self.dms = []
+
+    def __str__(self):
+        return f"loadtest-user-{self.id}"
+
+    async def send(self, content=None, embed=None, **kwargs):
+        await asyncio.sleep(random.uniform(*self.latency))
+        if random.random() < self.dm_failure_rate:
+            response = SimpleNamespace(status=403, reason="Forbidden")
+            raise self.discord.Forbidden(response, "Cannot send messages to this user")
+        self.dms.append(embed.description.strip("`") if embed else content)
+
+
+class FakeContext:
+    """Minimal commands.Context for calling command callbacks directly"""
+
+    def __init__(self, author, latency, interaction_id):
+        self.author = author
+        self.guild = None
+        self.interaction = SimpleNamespace(id=interaction_id)
+        self.latency = latency
+        self.replies = []
+
+    async def send(self, content=None, embed=None, **kwargs):
+        await asyncio.sleep(random.uniform(*self.latency))
+        self.replies.append(content if content is not None else (embed.title if embed else ""))
+
+    async def defer(self, **kwargs):
+        pass
+
+
+def classify(ctx):
+    """Turn a command's replies into an outcome label"""
+    if ctx.author.dms:
+        return "success"
+    text = " ".join(str(reply) for reply in ctx.replies)
+    if "cooldown" in text:
+        return "cooldown"
+    if "out of" in text:
+        return "empty"
+    if "couldn't DM" in text:
+        return "forbidden"
+    if "premium role" in text:
+        return "no_role"
+    if "error occurred" in text:
+        return "error"
+    return "ok"
+
+
+def arrival_times(count, args):
+    """Start offsets in seconds for `count` commands"""
+    if args.pattern == "burst":
+        return sorted(random.uniform(0, args.burst_window) for _ in range(count))
+    # Poisson arrivals at the configured aggregate rate
+    rate = args.rate / args.processes
+    times, now = [], 0.0
+    for _ in range(count):
+        now += random.expovariate(rate)
+        times.append(now)
+    return times
+
+
+async def drive(user_ids, args):
+    """Run one process's share of simulated users"""
+    import discord
+    import gen
+
+    commands = {"generate": gen.generate, "premium": gen.premium, "stats": gen.stats}
+    names = [name for name, _ in COMMAND_MIX]
+    weights = [weight for _, weight in COMMAND_MIX]
+    latency = (args.api_latency_ms[0] / 1000, args.api_latency_ms[1] / 1000)
+
+    roles = {
+        user_id: [FakeRole("Premium")] if random.random() < args.premium_ratio else []
+        for user_id in user_ids
+    }
+    jobs = [
+        (user_id, random.choices(names, weights)[0], user_id * 1000 + n)
+        for user_id in user_ids
+        for n in range(args.commands_per_user)
+    ]
+    random.shuffle(jobs)
+    records = []
+    origin = time.perf_counter()
+
+    # Some invocations are delivered twice with the same interaction id, like a Discord retry
+    offsets = arrival_times(len(jobs), args)
+    retries = [
+        (offset + random.uniform(0, args.retry_delay), job)
+        for offset, job in zip(offsets, jobs)
+        if random.random() < args.duplicate_rate
+    ]
+
+    async def run(offset, user_id, name, interaction_id):
+        await asyncio.sleep(max(0.0, origin + offset - time.perf_counter()))
+        author = FakeAuthor(discord, user_id, roles[user_id], args.dm_failure_rate, latency)
+        ctx = FakeContext(author, latency, interaction_id)
+        start = time.perf_counter()
+        if name == "stats":
+            await commands[name](ctx)
+        else:
+            await commands[name](ctx, None)
+        records.append({
+            "user_id": user_id,
+            "interaction_id": interaction_id,
+            "command": name,
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "outcome": classify(ctx),
+            "credentials": author.dms[0] if author.dms else None
+        })
+
+    await asyncio.gather(*(
+        run(offset, *job)
+        for offset, job in list(zip(offsets, jobs)) + retries
+    ))
+    return records
+
+
+def worker(workdir, user_ids, args, seed):
+    """Process entry point; the databases are relative to the working directory"""
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    random.seed(seed)
+    return asyncio.run(drive(user_ids, args))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def report(records, elapsed, workdir):
+    """Summarise latency, throughput and consistency checks"""
+    print(f"\n{len(records):,} commands in {elapsed:.2f}s ({len(records) / elapsed:,.1f} commands/s)\n")
+    print(f"{'command':<10} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    summary = {"commands": len(records), "elapsed_s": elapsed, "latency": {}}
+    for name, _ in COMMAND_MIX:
+        latencies = [r["latency_ms"] for r in records if r["command"] == name]
+        if not latencies:
+            continue
+        summary["latency"][name] = {
+            "count": len(latencies),
+            "p50_ms": percentile(latencies, 0.5),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": max(latencies),
+            "mean_ms": statistics.fmean(latencies)
+        }
+        print(
+            f"{name:<10} {len(latencies):>7} {summary['latency'][name]['p50_ms']:>9.2f} "
+            f"{summary['latency'][name]['p99_ms']:>9.2f} {max(latencies):>9.2f}"
+        )
+
+    outcomes = Counter(f"{r['command']}:{r['outcome']}" for r in records)
+    summary["outcomes"] = dict(outcomes)
+    print("\nOutcomes: " + ", ".join(f"{key}={count}" for key, count in sorted(outcomes.items())))
+
+    # Consistency checks against what actually reached the databases
+    # A retried invocation may deliver its item again, but only for the same interaction
+    claims = {(r["interaction_id"], r["credentials"]) for r in records if r["credentials"]}
+    delivered = Counter(cred for _, cred in claims)
+    double_claims = {cred: count for cred, count in delivered.items() if count > 1}
+
+    from storage import StockStore
+    store = StockStore(
+        os.path.join(workdir, "accounts.snap"),
+        os.path.join(workdir, "accounts.log"),
+        os.path.join(workdir, "accounts.json")
+    )
+    used = {
+        service_stock.credentials(index)
+        for services in store.read().values()
+        for service_stock in services.values()
+        for index in range(len(service_stock))
+        if service_stock.is_used(index)
+    }
+    lost_claims = [cred for cred in delivered if cred not in used]
+
+    stats_path = os.path.join(workdir, "stats.json")
+    stats = {}
+    if os.path.exists(stats_path):
+        try:
+            with open(stats_path, 'r') as f:
+                stats = json.load(f)
+        except json.JSONDecodeError as e:
+            print(f"stats.json is CORRUPTED after the run (torn write): {e}")
+    counted = stats.get("free_generated", 0) + stats.get("premium_generated", 0)
+    successes = len(claims)
+
+    summary.update({
+        "double_claims": len(double_claims),
+        "lost_claim_writes": len(lost_claims),
+        "stats_delivered": successes,
+        "stats_counted": counted
+    })
+    print(f"\nDouble claims:      {len(double_claims)}")
+    print(f"Lost claim writes:  {len(lost_claims)} delivered items not marked used")
+    print(f"Lost stat writes:   {successes - counted} ({successes} delivered, {counted} counted)")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the bot's commands")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--commands-per-user", type=int, default=2)
+    parser.add_argument("--stock", type=int, default=5000, help="Available items to generate")
+    parser.add_argument("--services", type=int, default=20)
+    parser.add_argument("--pattern", choices=("poisson", "burst"), default="poisson")
+    parser.add_argument("--rate", type=float, default=200.0, help="Poisson arrivals per second")
+    parser.add_argument("--burst-window", type=float, default=5.0, help="Seconds a burst is spread over")
+    parser.add_argument("--premium-ratio", type=float, default=0.2)
+    parser.add_argument("--dm-failure-rate", type=float, default=0.05)
+    parser.add_argument("--api-latency-ms", type=float, nargs=2, default=[20.0, 120.0], metavar=("MIN", "MAX"))
+    parser.add_argument("--processes", type=int, default=1, help="Bot processes sharing the databases")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="Fraction of invocations delivered twice with the same interaction id")
+    parser.add_argument("--retry-delay", type=float, default=0.5, help="Max seconds before a duplicate arrives")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Write the summary as JSON")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    from bench import generate_inventory
+
+    random.seed(args.seed)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    try:
+        # Written in the legacy format; the first process to open the store migrates it
+        with open(os.path.join(workdir, "accounts.json"), 'w') as f:
+            json.dump(generate_inventory(args.stock, args.services, 0.0), f)
+
+        user_ids = [10**17 + i for i in range(args.users)]
+        shares = [user_ids[i::args.processes] for i in range(args.processes)]
+        print(
+            f"Driving {args.users:,} users x {args.commands_per_user} commands "
+            f"({args.pattern}) across {args.processes} process(es)...",
+            flush=True
+        )
+
+        start = time.perf_counter()
+        if args.processes == 1:
+            records = worker(workdir, shares[0], args, args.seed)
+        else:
+            with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+                results = pool.starmap(
+                    worker,
+                    [(workdir, share, args, args.seed + i) for i, share in enumerate(shares)]
+                )
+            records = [record for result in results for record in result]
+        elapsed = time.perf_counter() - start
+
+        summary = report(records, elapsed, workdir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""Replay a recorded interaction trace against a copy of the bot's storage.
+
+Record a trace by setting "trace": {"enabled": true} in config.json; the bot
+then appends one anonymized line per command invocation to trace.ndjson.
+
+Usage:
+    python replay.py trace.ndjson                            # real time, against ./ databases
+    python replay.py trace.ndjson --speed 10 --storage /backups/saturday
+    python replay.py trace.ndjson --speed 0 --output replay.json   # as fast as possible
+
+The storage directory is copied to a scratch directory first, so the real
+databases are never touched. /generate, /premium, /stats and /services are
+replayed through the real command callbacks with the recorded timing divided
+by --speed; other commands are skipped. Hashed users are mapped to stable
+fake ids, and a user gets the premium role unless every premium invocation
+they made was refused for lacking it. Guilds are not replayed; everything
+runs against the shared (non-guild) databases.
+
+The report lists replayed latency against the recorded latency per command,
+outcome counts for both, and storage I/O per operation.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Everything the bot reads or writes, relative to its working directory
+STORAGE_FILES = (
+    "config.json", "accounts.json", "accounts.snap", "accounts.log",
+    "cooldowns.json", "stats.json", "drops.json"
+)
+STORAGE_DIRS = ("guilds",)
+
+REPLAYED_COMMANDS = ("generate", "premium", "stats", "services")
+
+
+def copy_storage(source, workdir):
+    """Copy the databases the bot uses into the scratch directory"""
+    for name in STORAGE_FILES:
+        path = os.path.join(source, name)
+        if os.path.exists(path):
+            shutil.copy2(path, os.path.join(workdir, name))
+    for name in STORAGE_DIRS:
+        path = os.path.join(source, name)
+        if os.path.isdir(path):
+            shutil.copytree(path, os.path.join(workdir, name))
+
+
+def load_trace(path, fields, args):
+    """Trace events as dicts, oldest first"""
+    events = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = dict(zip(fields, json.loads(line)))
+            except json.JSONDecodeError:
+                continue
+            if args.since and event["time"] < args.since:
+                continue
+            if args.until and event["time"] >= args.until:
+                continue
+            events.append(event)
+    events.sort(key=lambda event: event["time"])
+    return events[:args.limit] if args.limit else events
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def replay(events, args):
+    """Feed trace events into the command callbacks on the recorded schedule"""
+    import discord
+    import gen
+    from loadtest import FakeAuthor, FakeContext, FakeRole, classify
+
+    commands = {name: getattr(gen, name) for name in REPLAYED_COMMANDS}
+    latency = (args.api_latency_ms[0] / 1000, args.api_latency_ms[1] / 1000)
+
+    user_ids = {}
+    refused = {}
+    for event in events:
+        user_ids.setdefault(event["user"], 10**17 + len(user_ids))
+        if event["command"] == "premium":
+            refused[event["user"]] = refused.get(event["user"], True) and event["outcome"] == "no_role"
+    roles = {
+        user: [] if refused.get(user) else [FakeRole("Premium")]
+        for user in user_ids
+    }
+
+    records = []
+    behind = []
+    first = events[0]["time"] if events else 0.0
+    origin = time.perf_counter()
+
+    async def run(n, event):
+        if args.speed:
+            delay = origin + (event["time"] - first) / args.speed - time.perf_counter()
+            await asyncio.sleep(max(0.0, delay))
+            behind.append(max(0.0, -delay))
+        author = FakeAuthor(discord, user_ids[event["user"]], roles[event["user"]], args.dm_failure_rate, latency)
+        ctx = FakeContext(author, latency, interaction_id=n + 1)
+        start = time.perf_counter()
+        if event["command"] in ("generate", "premium"):
+            await commands[event["command"]](ctx, event["service"])
+        else:
+            await commands[event["command"]](ctx)
+        records.append({
+            "command": event["command"],
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "outcome": classify(ctx)
+        })
+
+    await asyncio.gather(*(
+        run(n, event) for n, event in enumerate(events)
+        if event["command"] in commands
+    ))
+    return records, behind, storage_io(gen)
+
+
+def storage_io(gen):
+    """Storage operations, seconds and bytes per op, from the bot's metrics"""
+    io = {}
+    for (op, _), (count, seconds) in gen.STORAGE_LATENCY.values().items():
+        entry = io.setdefault(op, {"count": 0, "seconds": 0.0, "bytes": 0})
+        entry["count"] += count
+        entry["seconds"] += seconds
+    for (op, _), nbytes in gen.STORAGE_BYTES.values().items():
+        io.setdefault(op, {"count": 0, "seconds": 0.0, "bytes": 0})["bytes"] += nbytes
+    return io
+
+
+def report(events, records, behind, io, elapsed):
+    """Print and return latency, outcome and storage I/O summaries"""
+    skipped = Counter(event["command"] for event in events if event["command"] not in REPLAYED_COMMANDS)
+    span = events[-1]["time"] - events[0]["time"] if events else 0.0
+    print(
+        f"\nReplayed {len(records):,} of {len(events):,} events "
+        f"({span:.1f}s of trace) in {elapsed:.2f}s"
+    )
+    if skipped:
+        print("Skipped: " + ", ".join(f"{name}={count}" for name, count in sorted(skipped.items())))
+    if behind:
+        print(f"Schedule lag: p99 {percentile(behind, 0.99) * 1000:.1f} ms, max {max(behind) * 1000:.1f} ms")
+
+    summary = {"events": len(events), "replayed": len(records), "elapsed_s": elapsed, "latency": {}}
+    print(f"\n{'command':<10} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}   {'recorded p50/p99':>18}")
+    for name in REPLAYED_COMMANDS:
+        latencies = [r["latency_ms"] for r in records if r["command"] == name]
+        if not latencies:
+            continue
+        recorded = [e["latency_ms"] for e in events if e["command"] == name and e.get("latency_ms") is not None]
+        summary["latency"][name] = {
+            "count": len(latencies),
+            "p50_ms": percentile(latencies, 0.5),
+            "p90_ms": percentile(latencies, 0.9),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": max(latencies),
+            "recorded_p50_ms": percentile(recorded, 0.5),
+            "recorded_p99_ms": percentile(recorded, 0.99)
+        }
+        result = summary["latency"][name]
+        print(
+            f"{name:<10} {len(latencies):>7} {result['p50_ms']:>9.2f} {result['p90_ms']:>9.2f} "
+            f"{result['p99_ms']:>9.2f} {result['max_ms']:>9.2f}   "
+            f"{result['recorded_p50_ms']:>8.2f}/{result['recorded_p99_ms']:<8.2f}"
+        )
+
+    replayed = Counter(f"{r['command']}:{r['outcome']}" for r in records)
+    recorded = Counter(
+        f"{e['command']}:{e['outcome'] or 'ok'}" for e in events if e["command"] in REPLAYED_COMMANDS
+    )
+    summary["outcomes"] = {"replayed": dict(replayed), "recorded": dict(recorded)}
+    print(f"\n{'outcome':<24} {'recorded':>9} {'replayed':>9}")
+    for key in sorted(set(replayed) | set(recorded)):
+        print(f"{key:<24} {recorded.get(key, 0):>9} {replayed.get(key, 0):>9}")
+
+    summary["storage_io"] = io
+    print(f"\n{'storage op':<16} {'count':>8} {'total ms':>10} {'mean ms':>9} {'bytes':>12}")
+    for op, entry in sorted(io.items()):
+        mean = entry["seconds"] / entry["count"] * 1000 if entry["count"] else 0.0
+        print(f"{op:<16} {entry['count']:>8} {entry['seconds'] * 1000:>10.1f} {mean:>9.3f} {entry['bytes']:>12,}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded interaction trace")
+    parser.add_argument("trace", help="Trace file written by the bot")
+    parser.add_argument("--storage", default=".", help="Directory holding the databases to copy")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed multiplier; 0 replays as fast as possible")
+    parser.add_argument("--since", type=float, help="Only events at or after this epoch time")
+    parser.add_argument("--until", type=float, help="Only events before this epoch time")
+    parser.add_argument("--limit", type=int, help="Replay at most this many events")
+    parser.add_argument("--dm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--api-latency-ms", type=float, nargs=2, default=[20.0, 120.0], metavar=("MIN", "MAX"))
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Write the summary as JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    trace = os.path.abspath(args.trace)
+    storage = os.path.abspath(args.storage)
+    output = os.path.abspath(args.output) if args.output else None
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    try:
+        copy_storage(storage, workdir)
+        # The bot uses relative database paths, so import it from the scratch copy
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_DIR)
+        import gen
+
+        events = load_trace(trace, gen.TRACE_FIELDS, args)
+        print(f"Replaying {len(events):,} events at {args.speed or 'max'}x against a copy of {storage}...", flush=True)
+        start = time.perf_counter()
+        records, behind, io = asyncio.run(replay(events, args))
+        summary = report(events, records, behind, io, time.perf_counter() - start)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(summary, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
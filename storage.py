@@ -0,0 +1,1235 @@
+import os
+import io
+import re
+import csv
+import sys
+import json
+import fnmatch
+import mmap
+import time
+import zlib
+import random
+import struct
+import secrets
+import threading
+from array import array
+from itertools import accumulate
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Locks held by the current thread, so nested operations can re-enter
+_held = threading.local()
+
+
+def _acquire(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK gives up after ~10 seconds; keep waiting
+            continue
+
+
+def _release(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on a database file, shared by every process using it"""
+    lock_path = f"{path}.lock"
+    held = getattr(_held, 'locks', None)
+    if held is None:
+        held = _held.locks = {}
+
+    if lock_path in held:
+        held[lock_path] += 1
+        try:
+            yield
+        finally:
+            held[lock_path] -= 1
+        return
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _acquire(fd)
+        held[lock_path] = 1
+        try:
+            yield
+        finally:
+            del held[lock_path]
+            _release(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, raw, binary=False):
+    """Replace a file's contents so readers never see a partial write.
+
+    `raw` is a string or an iterable of chunks (bytes-like when binary).
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb' if binary else 'w') as f:
+            if isinstance(raw, (str, bytes)):
+                f.write(raw)
+            else:
+                f.writelines(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Snapshot columns in file order; None marks a bytearray column
+STOCK_COLUMNS = (
+    ("data", None),
+    ("offsets", "I"),
+    ("used", None),
+    ("used_by", "q"),
+    ("used_at", "q"),
+    ("free", "I")
+)
+
+
+class ServiceStock:
+    """Columnar stock for one (tier, service).
+
+    Credentials are packed back to back in one UTF-8 buffer, item i spanning
+    data[offsets[i]:offsets[i + 1]]. The used flag is a bitset, claimant ids and
+    claim times (epoch seconds) are integer arrays where 0 means unset, and
+    `free` holds the indexes of unused items so a random claim is O(1).
+    Offsets are 32-bit, so one service holds at most 4 GiB of credentials.
+
+    Stock read from a snapshot keeps its columns in the memory-mapped file
+    until one of them is first touched.
+
+    Items staged for a scheduled drop are stored but left out of `free`;
+    `staged` maps each drop id to [next, end], the range not yet released.
+    """
+    __slots__ = ('data', 'offsets', 'used', 'used_by', 'used_at', 'free', 'staged', '_available', '_pending')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('I', [0])
+        self.used = bytearray()
+        self.used_by = array('q')
+        self.used_at = array('q')
+        self.free = array('I')
+        self.staged = {}
+        self._available = 0
+        self._pending = None
+
+    # The panel reads the same stock from several threads; only one may load a column set
+    _load_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Only called for columns that have not been loaded yet
+        if name in self.__slots__:
+            with ServiceStock._load_lock:
+                if self._pending is not None:
+                    self._load()
+            return object.__getattribute__(self, name)
+        raise AttributeError(name)
+
+    @classmethod
+    def from_snapshot(cls, buffer, entry, base, swap):
+        stock = cls.__new__(cls)
+        stock.staged = entry.get("staged", {})
+        stock._available = entry["available"]
+        stock._pending = (buffer, entry, base, swap)
+        return stock
+
+    def _load(self):
+        # Every column is set before _pending is cleared, so unlocked readers never see half a load
+        buffer, entry, base, swap = self._pending
+        for name, typecode in STOCK_COLUMNS:
+            start, length = entry["sections"][name]
+            raw = buffer[base + start:base + start + length]
+            if typecode:
+                column = array(typecode)
+                column.frombytes(raw)
+                if swap:
+                    column.byteswap()
+            else:
+                column = bytearray(raw)
+            setattr(self, name, column)
+        self._pending = None
+
+    def __len__(self):
+        if self._pending is not None:
+            return self._pending[1]["count"]
+        return len(self.used_by)
+
+    @property
+    def available(self):
+        return self._available
+
+    def append(self, credentials, used=False, used_by=None, used_at=None, staged=False):
+        """Add an item; used_at is epoch seconds"""
+        index = len(self)
+        self.data += credentials.encode('utf-8')
+        self.offsets.append(len(self.data))
+        if index % 8 == 0:
+            self.used.append(0)
+        self.used_by.append(int(used_by or 0))
+        self.used_at.append(int(used_at or 0))
+        if used:
+            self.used[index >> 3] |= 1 << (index & 7)
+        elif not staged:
+            self.free.append(index)
+            self._available += 1
+        return index
+
+    def stage(self, drop_id, credentials_list):
+        """Add items that stay invisible until their drop is released"""
+        start = len(self)
+        for credentials in credentials_list:
+            self.append(credentials, staged=True)
+        self.staged[drop_id] = [start, len(self)]
+        return start
+
+    def release(self, drop_id, until):
+        """Make a drop's items visible up to index `until`; returns how many were released"""
+        entry = self.staged.get(drop_id)
+        if not entry:
+            return 0
+        next_index, end = entry
+        until = min(until, end)
+        if until <= next_index:
+            return 0
+        self.free.extend(range(next_index, until))
+        self._available += until - next_index
+        if until == end:
+            del self.staged[drop_id]
+        else:
+            entry[0] = until
+        return until - next_index
+
+    def is_staged(self, index):
+        return any(next_index <= index < end for next_index, end in self.staged.values())
+
+    def credentials(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+
+    def is_used(self, index):
+        return bool(self.used[index >> 3] & (1 << (index & 7)))
+
+    def pick_random(self):
+        """Index of a random unused item, or None"""
+        # `free` may still hold items claimed since; drop them as they turn up
+        while self.free:
+            slot = random.randrange(len(self.free))
+            index = self.free[slot]
+            if not self.is_used(index):
+                return index
+            self.free[slot] = self.free[-1]
+            self.free.pop()
+        return None
+
+    def pick_many(self, count):
+        """Indexes of up to `count` distinct random unused items"""
+        # A partial shuffle of `free`: the first `picked` slots hold the picks
+        free = self.free
+        picked = 0
+        chosen = set()
+        while picked < count and picked < len(free):
+            slot = random.randrange(picked, len(free))
+            index = free[slot]
+            # Requeued items can appear twice; drop claimed and repeated entries as they turn up
+            if self.is_used(index) or index in chosen:
+                free[slot] = free[-1]
+                free.pop()
+                continue
+            free[slot], free[picked] = free[picked], index
+            chosen.add(index)
+            picked += 1
+        return list(free[:picked])
+
+    def mark_used(self, index, used_by=None, used_at=None):
+        if not self.is_used(index):
+            self._available -= 1
+        self.used[index >> 3] |= 1 << (index & 7)
+        self.used_by[index] = int(used_by or 0)
+        self.used_at[index] = int(used_at or time.time())
+
+    def requeue(self, index):
+        """Return a claimed item to the pool"""
+        if not self.is_used(index):
+            return
+        self.used[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+        self.used_by[index] = 0
+        self.used_at[index] = 0
+        self.free.append(index)
+        self._available += 1
+
+    def take(self, indexes):
+        """A new ServiceStock with copies of the items at `indexes`, in order, built column by column"""
+        taken = ServiceStock()
+        data, offsets = memoryview(self.data), self.offsets
+        chunks = [data[offsets[index]:offsets[index + 1]] for index in indexes]
+        taken.data = bytearray(b"".join(chunks))
+        taken.offsets.extend(accumulate(len(chunk) for chunk in chunks))
+        data.release()
+        taken.used = bytearray((len(indexes) + 7) // 8)
+        for position, index in enumerate(indexes):
+            if self.is_used(index):
+                taken.used[position >> 3] |= 1 << (position & 7)
+            else:
+                taken.free.append(position)
+        taken.used_by = array('q', (self.used_by[index] for index in indexes))
+        taken.used_at = array('q', (self.used_at[index] for index in indexes))
+        taken._available = len(taken.free)
+        return taken
+
+    def remove(self, indexes):
+        """Delete items, keeping the rest in order; returns an old -> new index map, -1 if removed.
+
+        Staged items must not be removed; their ranges move with the items before them.
+        """
+        kept, remap = self.without(indexes)
+        for name in self.__slots__:
+            setattr(self, name, getattr(kept, name))
+        return remap
+
+    def without(self, indexes):
+        """A new ServiceStock without the items at `indexes`, and the old -> new index map"""
+        removed = set(indexes)
+        keep = [index for index in range(len(self)) if index not in removed]
+        remap = array('q', [-1]) * len(self)
+        for position, index in enumerate(keep):
+            remap[index] = position
+        kept = self.take(keep)
+        # Staged items are unused but not yet free
+        staged = {
+            drop_id: [remap[next_index], remap[next_index] + end - next_index]
+            for drop_id, (next_index, end) in self.staged.items()
+        }
+        if staged:
+            spans = [range(next_index, end) for next_index, end in staged.values()]
+            kept.free = array('I', (index for index in kept.free if not any(index in span for span in spans)))
+            kept._available = len(kept.free)
+        kept.staged = staged
+        return kept, remap
+
+    def claim_random(self, used_by=None, used_at=None):
+        """Mark a random unused item as used and return its index, or None"""
+        index = self.pick_random()
+        if index is not None:
+            self.mark_used(index, used_by, used_at)
+        return index
+
+    def item(self, index):
+        """An item in the JSON database format"""
+        used_at = self.used_at[index]
+        return {
+            "credentials": self.credentials(index),
+            "used": self.is_used(index),
+            "used_by": self.used_by[index] or None,
+            "used_at": datetime.fromtimestamp(used_at).isoformat() if used_at else None
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.item(index)
+
+    @classmethod
+    def from_items(cls, items):
+        """Build from items in the JSON database format"""
+        stock = cls()
+        for item in items:
+            used_at = item.get("used_at")
+            stock.append(
+                item["credentials"],
+                item.get("used", False),
+                item.get("used_by"),
+                datetime.fromisoformat(used_at).timestamp() if used_at else None
+            )
+        return stock
+
+
+EXPORT_FIELDS = ["type", "service", "credentials", "used", "used_by", "used_at"]
+
+
+def iter_export_rows(stock, account_type=None, service=None, status=None, since=None, until=None):
+    """Yield stock items one at a time, filtered for export"""
+    since_ts = since.timestamp() if since else None
+    until_ts = until.timestamp() if until else None
+
+    for acc_type in ("free", "premium"):
+        if account_type and acc_type != account_type:
+            continue
+        for serv, service_stock in list(stock.get(acc_type, {}).items()):
+            if service and serv != service:
+                continue
+            for index in range(len(service_stock)):
+                # Staged drop items are not stock yet
+                if service_stock.staged and service_stock.is_staged(index):
+                    continue
+                used = service_stock.is_used(index)
+                if status == "available" and used:
+                    continue
+                if status == "used" and not used:
+                    continue
+                # Date range applies to the claim time
+                if since_ts or until_ts:
+                    used_at = service_stock.used_at[index]
+                    if not used_at:
+                        continue
+                    if since_ts and used_at < since_ts:
+                        continue
+                    if until_ts and used_at >= until_ts:
+                        continue
+                yield {"type": acc_type, "service": serv, **service_stock.item(index)}
+
+
+def iter_export_lines(rows, fmt="ndjson"):
+    """Encode export rows as NDJSON or CSV lines"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Header only when there were no rows
+        if buffer.getvalue():
+            yield buffer.getvalue()
+    else:
+        for row in rows:
+            yield json.dumps(row) + "\n"
+
+
+def load_stock(accounts):
+    """Convert a JSON accounts database to {tier: {service: ServiceStock}}"""
+    return {
+        tier: {service: ServiceStock.from_items(items) for service, items in services.items()}
+        for tier, services in accounts.items()
+    }
+
+
+# Log records: each op name maps to a function applying it to the stock
+def _apply_add(stock, record):
+    service_stock = stock.setdefault(record["tier"], {}).setdefault(record["service"], ServiceStock())
+    for credentials in record["credentials"]:
+        service_stock.append(credentials)
+
+
+def _apply_stage(stock, record):
+    service_stock = stock.setdefault(record["tier"], {}).setdefault(record["service"], ServiceStock())
+    service_stock.stage(record["drop"], record["credentials"])
+
+
+def _apply_release(stock, record):
+    service_stock = stock.get(record["tier"], {}).get(record["service"])
+    if service_stock:
+        service_stock.release(record["drop"], record["until"])
+
+
+def _apply_claim(stock, record):
+    stock[record["tier"]][record["service"]].mark_used(
+        record["index"], record.get("used_by"), record.get("used_at")
+    )
+
+
+# Bulk records select their items when applied, so replaying one selects the same items
+def bulk_targets(stock, record):
+    """(tier, service, ServiceStock) for each service a bulk record covers; None means all"""
+    tiers = [record["tier"]] if record.get("tier") else list(stock)
+    for tier in tiers:
+        services = stock.get(tier, {})
+        names = [record["service"]] if record.get("service") else list(services)
+        for service in names:
+            if service in services:
+                yield tier, service, services[service]
+
+
+def bulk_matches(service_stock, record):
+    """Indexes a purge, move or requeue record applies to; staged items never match"""
+    if record["op"] == "requeue":
+        since = record["since"]
+        return [
+            index for index, used_at in enumerate(service_stock.used_at)
+            if used_at >= since and service_stock.is_used(index)
+        ]
+
+    indexes = range(len(service_stock))
+    pattern = record.get("pattern")
+    if pattern:
+        # Match the raw buffer in place instead of decoding every item
+        match = re.compile(fnmatch.translate(pattern).encode('utf-8')).match
+        data, offsets = service_stock.data, service_stock.offsets
+        indexes = [index for index in indexes if match(data, offsets[index], offsets[index + 1])]
+    if service_stock.staged:
+        indexes = [index for index in indexes if not service_stock.is_staged(index)]
+    return list(indexes)
+
+
+def plan_bulk(stock, record):
+    """{(tier, service): indexes} a bulk record would touch, leaving out services with no matches"""
+    plan = {}
+    for tier, service, service_stock in bulk_targets(stock, record):
+        if record["op"] == "move" and tier == record["to"]:
+            continue
+        indexes = bulk_matches(service_stock, record)
+        if indexes:
+            plan[tier, service] = indexes
+    return plan
+
+
+def _remove_items(stock, tier, service, service_stock, indexes):
+    if len(indexes) == len(service_stock):
+        del stock[tier][service]
+        return array('q', [-1]) * len(service_stock)
+    # A new object, so readers still holding the old one see it unchanged
+    stock[tier][service], remap = service_stock.without(indexes)
+    return remap
+
+
+# Bulk handlers take the plan_bulk result when the caller already matched against this state
+def _apply_purge(stock, record, plan=None):
+    remaps = {}
+    for (tier, service), indexes in (plan_bulk(stock, record) if plan is None else plan).items():
+        remaps[tier, service] = _remove_items(stock, tier, service, stock[tier][service], indexes)
+    return remaps
+
+
+def _apply_move(stock, record, plan=None):
+    remaps = {}
+    for (tier, service), indexes in (plan_bulk(stock, record) if plan is None else plan).items():
+        service_stock = stock[tier][service]
+        targets = stock.setdefault(record["to"], {})
+        if service in targets:
+            target = targets[service]
+            start = len(target)
+            for index in indexes:
+                target.append(
+                    service_stock.credentials(index), service_stock.is_used(index),
+                    service_stock.used_by[index], service_stock.used_at[index]
+                )
+        else:
+            start = 0
+            targets[service] = service_stock.take(indexes)
+        # Where each moved item landed in the target service
+        moved = array('q', [-1]) * len(service_stock)
+        for position, index in enumerate(indexes):
+            moved[index] = start + position
+        remaps[tier, service] = (_remove_items(stock, tier, service, service_stock, indexes), record["to"], moved)
+    return remaps
+
+
+def _apply_requeue(stock, record, plan=None):
+    remaps = {}
+    for (tier, service), indexes in (plan_bulk(stock, record) if plan is None else plan).items():
+        service_stock = stock[tier][service]
+        remap = array('q', range(len(service_stock)))
+        for index in indexes:
+            service_stock.requeue(index)
+            remap[index] = -1
+        remaps[tier, service] = remap
+    return remaps
+
+
+# Handlers that move or free items return {(tier, service): old -> new index map};
+# for a move the value is (map, target tier, old -> index in the target service)
+RECORD_HANDLERS = {
+    "add": _apply_add,
+    "claim": _apply_claim,
+    "stage": _apply_stage,
+    "release": _apply_release,
+    "purge": _apply_purge,
+    "move": _apply_move,
+    "requeue": _apply_requeue
+}
+
+SNAPSHOT_MAGIC = b"RGSNAP01"
+_SNAPSHOT_HEADER = struct.Struct("<QI")  # generation, directory length
+
+
+def _encode_record(record):
+    """One log line: CRC32 of the payload, then the JSON payload"""
+    payload = json.dumps(record, separators=(",", ":"))
+    return f"{zlib.crc32(payload.encode('utf-8')):08x} {payload}\n".encode('utf-8')
+
+
+def _decode_record(line):
+    """Parse a log line, or None if it is torn or corrupt"""
+    if len(line) < 10 or line[8:9] != b" ":
+        return None
+    payload = line[9:]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def write_snapshot(path, stock, generation, meta=None):
+    """Write {tier: {service: ServiceStock}} as a binary snapshot, with extra JSON-able metadata"""
+    entries, offset = [], 0
+    for tier, services in stock.items():
+        for service, service_stock in services.items():
+            sections = {}
+            for name, typecode in STOCK_COLUMNS:
+                column = getattr(service_stock, name)
+                length = len(column) * (column.itemsize if typecode else 1)
+                sections[name] = [offset, length]
+                offset += length
+            entries.append({
+                "tier": tier,
+                "service": service,
+                "count": len(service_stock),
+                "available": service_stock.available,
+                "staged": service_stock.staged,
+                "sections": sections
+            })
+
+    directory = json.dumps({
+        "byteorder": sys.byteorder,
+        "tiers": list(stock),
+        "services": entries,
+        **(meta or {})
+    }).encode('utf-8')
+
+    def chunks():
+        yield SNAPSHOT_MAGIC + _SNAPSHOT_HEADER.pack(generation, len(directory))
+        yield directory
+        for services in stock.values():
+            for service_stock in services.values():
+                for name, _ in STOCK_COLUMNS:
+                    yield getattr(service_stock, name)
+
+    atomic_write(path, chunks(), binary=True)
+
+
+def read_snapshot(path):
+    """Map a snapshot; columns are only read when a service is first used.
+
+    Returns (stock, generation, directory, buffer); the directory holds any metadata.
+    On Windows the file is read into memory instead: a file mapped by any process
+    can't be replaced there, which would make every later compaction fail.
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if fcntl else f.read()
+    if buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        if fcntl:
+            buffer.close()
+        raise ValueError(f"{path} is not a stock snapshot")
+
+    generation, directory_length = _SNAPSHOT_HEADER.unpack_from(buffer, len(SNAPSHOT_MAGIC))
+    start = len(SNAPSHOT_MAGIC) + _SNAPSHOT_HEADER.size
+    directory = json.loads(buffer[start:start + directory_length])
+    base = start + directory_length
+    swap = directory["byteorder"] != sys.byteorder
+
+    stock = {tier: {} for tier in directory["tiers"]}
+    for entry in directory["services"]:
+        stock[entry["tier"]][entry["service"]] = ServiceStock.from_snapshot(buffer, entry, base, swap)
+    return stock, generation, directory, buffer
+
+
+# Rollup resolutions: name, bucket width in seconds, buckets kept
+ROLLUP_RESOLUTIONS = (
+    ("minute", 60, 180),
+    ("hour", 3600, 24 * 14),
+    ("day", 86400, 365)
+)
+
+
+class Rollups:
+    """Claim counts per (tier, service) in minute, hour and day buckets.
+
+    A claim increments one bucket at every resolution. Buckets past their
+    resolution's retention are dropped, so fine-grained history is only
+    kept for recent claims and reads never depend on the number of items.
+    """
+
+    def __init__(self):
+        # resolution -> tier -> service -> {bucket start: count}
+        self.buckets = {name: {} for name, _, _ in ROLLUP_RESOLUTIONS}
+
+    def record(self, tier, service, timestamp, count=1):
+        timestamp = int(timestamp)
+        now = int(time.time())
+        for name, width, keep in ROLLUP_RESOLUTIONS:
+            start = timestamp - timestamp % width
+            cutoff = now - now % width - (keep - 1) * width
+            if start < cutoff:
+                continue
+            series = self.buckets[name].setdefault(tier, {}).setdefault(service, {})
+            if start not in series:
+                # New bucket; drop the ones that fell out of retention
+                for old in [old for old in series if old < cutoff]:
+                    del series[old]
+            series[start] = series.get(start, 0) + count
+
+    def series(self, resolution, points, tier=None, service=None, now=None):
+        """[[bucket start, count], ...] for the last `points` buckets, oldest first"""
+        width = dict((name, width) for name, width, _ in ROLLUP_RESOLUTIONS)[resolution]
+        now = int(now or time.time())
+        last = now - now % width
+        starts = [last - (points - 1 - i) * width for i in range(points)]
+        totals = dict.fromkeys(starts, 0)
+        for series_tier, services in self.buckets[resolution].items():
+            if tier and series_tier != tier:
+                continue
+            for series_service, series in services.items():
+                if service and series_service != service:
+                    continue
+                for start in starts:
+                    totals[start] += series.get(start, 0)
+        return [[start, totals[start]] for start in starts]
+
+    def total(self, resolution, points, tier=None, service=None, now=None):
+        """Claims in the last `points` buckets"""
+        return sum(count for _, count in self.series(resolution, points, tier, service, now))
+
+    def trends(self, stock, now=None):
+        """Claim rates and depletion ETAs per (tier, service), busiest first"""
+        trends = []
+        for tier, service in self.services():
+            last_day = self.total("hour", 24, tier, service, now)
+            if not last_day:
+                continue
+            service_stock = stock.get(tier, {}).get(service)
+            available = service_stock.available if service_stock else 0
+            per_hour = last_day / 24
+            trends.append({
+                "tier": tier,
+                "service": service,
+                "last_hour": self.total("minute", 60, tier, service, now),
+                "last_day": last_day,
+                "per_hour": per_hour,
+                "available": available,
+                "eta_hours": available / per_hour
+            })
+        trends.sort(key=lambda trend: trend["last_day"], reverse=True)
+        return trends
+
+    def services(self):
+        """(tier, service) pairs with any recorded claims"""
+        return {
+            (tier, service)
+            for tiers in self.buckets.values()
+            for tier, services in tiers.items()
+            for service in services
+        }
+
+    def to_dict(self):
+        return self.buckets
+
+    @classmethod
+    def from_dict(cls, data):
+        rollups = cls()
+        for name, tiers in data.items():
+            rollups.buckets[name] = {
+                tier: {
+                    service: {int(start): count for start, count in series.items()}
+                    for service, series in services.items()
+                }
+                for tier, services in tiers.items()
+            }
+        return rollups
+
+
+class StockStore:
+    """Stock persisted as a binary snapshot plus an append-only log.
+
+    Every change is appended to the log as one CRC-checked line and fsynced;
+    on load the snapshot is mapped and the log replayed on top. A torn last
+    line (a crash mid-append) fails its CRC and is cut off. compact() folds
+    the log into a new snapshot. The log header carries the snapshot
+    generation it applies to, so a crash between writing the snapshot and
+    resetting the log never replays records twice.
+
+    All access goes through transaction(), which holds the cross-process
+    lock and first catches up with records other processes appended.
+
+    Claim records may carry an idempotency key. Keys claimed within the
+    last claim_key_ttl seconds are kept in `claim_keys`, rebuilt from the
+    log and carried over into new snapshots, so every process sees them.
+    A "delivery" record flags a keyed claim whose item never reached the
+    user, so a retry knows it is completing the claim rather than repeating it.
+
+    Every claim also counts towards `rollups`, which are carried over into
+    new snapshots the same way.
+    """
+
+    def __init__(self, snapshot_path, log_path, lock_path, legacy_path=None, on_io=None, claim_key_ttl=900):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.lock_path = lock_path
+        self.legacy_path = legacy_path
+        self.on_io = on_io
+        self.claim_key_ttl = claim_key_ttl
+        self.reset()
+
+    def reset(self):
+        """Drop the in-memory state; the next transaction reloads from disk"""
+        self.stock = None
+        self.claim_keys = {}
+        self.rollups = Rollups()
+        self.generation = 0
+        self._buffer = None
+        self._snapshot_signature = None
+        self._log_inode = None
+        self._log_offset = 0
+
+    def _record_io(self, op, path, started, size):
+        if self.on_io:
+            self.on_io(op, path, time.perf_counter() - started, size)
+
+    @contextmanager
+    def transaction(self):
+        """Lock the store and yield the up-to-date stock"""
+        with file_lock(self.lock_path):
+            self._refresh()
+            yield self.stock
+
+    def read(self):
+        """Up-to-date stock, for callers that only read.
+
+        The tier and service dicts are copied under the lock, so later records
+        adding or removing services don't change them while the caller iterates.
+        """
+        with self.transaction() as stock:
+            return {tier: dict(services) for tier, services in stock.items()}
+
+    @property
+    def version(self):
+        """Identifies the state as of the last refresh; changes with every record applied"""
+        return f"{self.generation}.{self._log_offset}"
+
+    def append(self, *records, plan=None):
+        """Durably log records and apply them; call inside transaction().
+
+        `plan` is the plan_bulk result for a single bulk record, matched against the current state.
+        """
+        lines = b"".join(_encode_record(record) for record in records)
+        started = time.perf_counter()
+        with open(self.log_path, 'ab') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self._record_io("append", self.log_path, started, len(lines))
+        self._log_offset += len(lines)
+        for record in records:
+            self._apply(record, plan)
+        return len(lines)
+
+    def apply_bulk(self, record, dry_run=False):
+        """Count the items a purge, move or requeue record touches and, unless dry_run, apply it.
+
+        Items are matched without holding the lock; it is then only held to log and
+        apply the record, unless the state changed meanwhile and they are matched again.
+        """
+        with self.transaction() as stock:
+            version = self.version
+            stock = {tier: dict(services) for tier, services in stock.items()}
+        try:
+            plan = plan_bulk(stock, record)
+        except Exception:
+            # Changed by another thread mid-scan; anything else is raised again below
+            plan = None
+        if dry_run and plan is not None:
+            return sum(len(indexes) for indexes in plan.values())
+
+        try:
+            with self.transaction() as stock:
+                if plan is None or self.version != version:
+                    plan = plan_bulk(stock, record)
+                count = sum(len(indexes) for indexes in plan.values())
+                if count and not dry_run:
+                    self.append(record, plan=plan)
+        except Exception:
+            self.reset()
+            raise
+        return count
+
+    def claim_batch(self, tier, count, services=None, used_by=None, key=None):
+        """Claim `count` distinct random unused items in one write; None, claiming nothing, if fewer are available.
+
+        Each claim is keyed `<key>.<n>`, so repeating a key returns the same batch with "replayed" set.
+        """
+        with self.transaction() as stock:
+            if key:
+                claims = [self.claimed(f"{key}.{n}") for n in range(count)]
+                replayed = [
+                    {"service": service, "credentials": stock[claim_tier][service].credentials(index), "replayed": True}
+                    for claim_tier, service, index, _ in filter(None, claims)
+                ]
+                if replayed:
+                    return replayed
+
+            records = plan_batch_claim(stock, tier, services, count, used_by)
+            if records is None:
+                return None
+            if key:
+                for n, record in enumerate(records):
+                    record["key"] = f"{key}.{n}"
+            try:
+                self.append(*records)
+            except Exception:
+                # Memory may be ahead of the disk now; reload on next access
+                self.reset()
+                raise
+            return [
+                {"service": record["service"], "credentials": stock[tier][record["service"]].credentials(record["index"]), "replayed": False}
+                for record in records
+            ]
+
+    def _apply(self, record, plan=None):
+        if record["op"] == "delivery":
+            entry = self.claim_keys.get(record["key"])
+            if entry:
+                entry[4] = record["delivered"]
+            return
+
+        handler = RECORD_HANDLERS[record["op"]]
+        remaps = handler(self.stock, record) if plan is None else handler(self.stock, record, plan)
+        if remaps:
+            self._remap_claim_keys(remaps)
+        if record["op"] == "claim":
+            self.rollups.record(record["tier"], record["service"], record.get("used_at") or time.time())
+        if record.get("key"):
+            self.claim_keys[record["key"]] = [
+                record["tier"], record["service"], record["index"],
+                record.get("used_at") or int(time.time()), True
+            ]
+
+    def _remap_claim_keys(self, remaps):
+        """Follow items that moved, within their service or to another tier; keys for removed or requeued items are forgotten"""
+        for key, entry in list(self.claim_keys.items()):
+            remap = remaps.get((entry[0], entry[1]))
+            if remap is None:
+                continue
+            if isinstance(remap, tuple):
+                remap, to_tier, moved = remap
+                if entry[2] < len(moved) and moved[entry[2]] >= 0:
+                    entry[0], entry[2] = to_tier, moved[entry[2]]
+                    continue
+            index = remap[entry[2]] if entry[2] < len(remap) else -1
+            if index < 0:
+                del self.claim_keys[key]
+            else:
+                entry[2] = index
+
+    def claimed(self, key):
+        """(tier, service, index, delivered) of an unexpired claim with this key, or None"""
+        self._expire_claim_keys()
+        entry = self.claim_keys.get(key)
+        return tuple(entry[:3]) + (entry[4],) if entry else None
+
+    def mark_delivered(self, key, delivered):
+        """Record whether a keyed claim reached the user; call inside transaction()"""
+        if key in self.claim_keys and self.claim_keys[key][4] != delivered:
+            self.append({"op": "delivery", "key": key, "delivered": delivered})
+
+    def _expire_claim_keys(self):
+        # Keys are kept in claim order, so expired ones are at the front
+        cutoff = time.time() - self.claim_key_ttl
+        for key, entry in list(self.claim_keys.items()):
+            if entry[3] >= cutoff:
+                break
+            del self.claim_keys[key]
+
+    def log_size(self):
+        try:
+            return os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            return 0
+
+    def compact(self):
+        """Fold the log into a new snapshot"""
+        with self.transaction() as stock:
+            self._write_base(stock, self.generation + 1)
+
+    def replace(self, stock):
+        """Replace the whole stock"""
+        with file_lock(self.lock_path):
+            self._refresh()
+            # Item indexes change, so earlier claim keys no longer apply
+            self.claim_keys = {}
+            self._write_base(stock, self.generation + 1)
+
+    def _write_base(self, stock, generation):
+        started = time.perf_counter()
+        self._expire_claim_keys()
+        write_snapshot(self.snapshot_path, stock, generation, {
+            "claim_keys": self.claim_keys,
+            "rollups": self.rollups.to_dict()
+        })
+        self._record_io("snapshot_write", self.snapshot_path, started, os.path.getsize(self.snapshot_path))
+        self._reset_log(generation)
+        self.stock = stock
+        self.generation = generation
+        self._buffer = None
+        self._snapshot_signature = _signature(self.snapshot_path)
+
+    def _reset_log(self, generation):
+        header = _encode_record({"op": "header", "generation": generation})
+        atomic_write(self.log_path, [header], binary=True)
+        self._log_inode = os.stat(self.log_path).st_ino
+        self._log_offset = len(header)
+
+    def _refresh(self):
+        signature = _signature(self.snapshot_path)
+        if signature is None:
+            self._create()
+            return
+
+        if signature != self._snapshot_signature:
+            started = time.perf_counter()
+            stock, generation, directory, buffer = read_snapshot(self.snapshot_path)
+            self._record_io("snapshot_read", self.snapshot_path, started, signature[2])
+            # The old mapping is released once nothing refers to its stock
+            self.stock, self.generation, self._buffer = stock, generation, buffer
+            self.claim_keys = directory.get("claim_keys", {})
+            self.rollups = Rollups.from_dict(directory.get("rollups", {}))
+            self._snapshot_signature = signature
+            self._log_inode = None
+
+        self._replay()
+
+    def _create(self):
+        """First run: start from accounts.json if there is one"""
+        stock = {"free": {}, "premium": {}}
+        self.claim_keys = {}
+        self.rollups = Rollups()
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            with open(self.legacy_path, 'r') as f:
+                stock.update(load_stock(json.load(f)))
+            # Seed the rollups with past claims that are still within retention
+            for tier, services in stock.items():
+                for service, service_stock in services.items():
+                    for used_at in service_stock.used_at:
+                        if used_at:
+                            self.rollups.record(tier, service, used_at)
+        self._write_base(stock, 1)
+
+    def _replay(self):
+        """Apply log records appended since the last refresh"""
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            self._reset_log(self.generation)
+            return
+
+        if st.st_ino != self._log_inode:
+            self._log_inode = st.st_ino
+            self._log_offset = 0
+        if st.st_size == self._log_offset:
+            return
+
+        started = time.perf_counter()
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._log_offset)
+            raw = f.read()
+        self._record_io("log_read", self.log_path, started, len(raw))
+
+        position = 0
+        while position < len(raw):
+            end = raw.find(b"\n", position)
+            record = _decode_record(raw[position:end]) if end != -1 else None
+            if record is None:
+                # Torn or corrupt tail from a crash mid-append; we hold the lock, so cut it off
+                with open(self.log_path, 'r+b') as f:
+                    f.truncate(self._log_offset + position)
+                break
+
+            if record["op"] == "header":
+                if record["generation"] != self.generation:
+                    # Left over from a compaction that crashed before resetting the log
+                    self._reset_log(self.generation)
+                    return
+            else:
+                self._apply(record)
+            position = end + 1
+
+        self._log_offset += position
+
+
+def _signature(path):
+    """Identify a file version; atomic writes always change the inode"""
+    try:
+        st = os.stat(path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+
+GUILDS_DIR = 'guilds'
+
+
+class Partition:
+    """One guild's databases, or the top-level ones when guild_id is None.
+
+    A guild's files live in guilds/<guild_id>/ under the same names as the
+    top-level databases; its config.json only holds overrides.
+    """
+
+    def __init__(self, guild_id, on_io=None, claim_key_ttl=900):
+        self.guild_id = guild_id
+        self.directory = "" if guild_id is None else os.path.join(GUILDS_DIR, str(int(guild_id)))
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.accounts_db = self.path('accounts.json')
+        self.cooldowns_db = self.path('cooldowns.json')
+        self.stats_db = self.path('stats.json')
+        self.config_db = self.path('config.json')
+        # An accounts.json dropped into a new guild directory seeds its first snapshot
+        self.stock = StockStore(
+            self.path('accounts.snap'), self.path('accounts.log'),
+            self.accounts_db, self.accounts_db, on_io=on_io, claim_key_ttl=claim_key_ttl
+        )
+        self.last_used = time.monotonic()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+
+class PartitionCache:
+    """Partitions loaded on first use and dropped from memory once idle"""
+
+    def __init__(self, factory, idle_seconds=1800):
+        self.factory = factory
+        self.idle_seconds = idle_seconds
+        self._partitions = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                partition = self._partitions[key] = self.factory(key)
+            partition.last_used = now
+        if now - self._last_sweep >= min(60, self.idle_seconds):
+            self.evict_idle()
+        return partition
+
+    def evict_idle(self):
+        """Drop partitions unused for idle_seconds; the top-level one always stays"""
+        now = time.monotonic()
+        self._last_sweep = now
+        with self._lock:
+            idle = [
+                key for key, partition in self._partitions.items()
+                if key is not None and now - partition.last_used >= self.idle_seconds
+            ]
+            for key in idle:
+                del self._partitions[key]
+        return idle
+
+    def values(self):
+        with self._lock:
+            return list(self._partitions.values())
+
+    def __len__(self):
+        return len(self._partitions)
+
+
+def list_partitions():
+    """Guild ids that have a partition on disk"""
+    if not os.path.isdir(GUILDS_DIR):
+        return []
+    return sorted(int(name) for name in os.listdir(GUILDS_DIR) if name.isdigit())
+
+
+def plan_waves(total, release_at, wave_size=None, interval=600):
+    """Split a drop of `total` items into [[epoch, count], ...] waves of at most wave_size, `interval` seconds apart"""
+    wave_size = wave_size or total
+    return [
+        [int(release_at + i * interval), min(wave_size, total - start)]
+        for i, start in enumerate(range(0, total, wave_size))
+    ]
+
+
+def stage_drop(partition, drops_db, tier, service, credentials_list, waves):
+    """Stage items hidden in a partition's stock and register their release waves in drops_db; returns the drop id"""
+    store = partition.stock
+    drop_id = secrets.token_hex(4)
+    with file_lock(drops_db):
+        try:
+            with store.transaction():
+                store.append({
+                    "op": "stage",
+                    "tier": tier,
+                    "service": service,
+                    "drop": drop_id,
+                    "credentials": list(credentials_list)
+                })
+        except Exception:
+            store.reset()
+            raise
+
+        drops = {}
+        if os.path.exists(drops_db):
+            started = time.perf_counter()
+            with open(drops_db, 'rb') as f:
+                raw = f.read()
+            drops = json.loads(raw)
+            store._record_io("read", drops_db, started, len(raw))
+        drops[drop_id] = {
+            "guild_id": partition.guild_id,
+            "tier": tier,
+            "service": service,
+            "items": len(credentials_list),
+            "released": 0,
+            "waves": waves,
+            "created_at": datetime.now().isoformat()
+        }
+        started = time.perf_counter()
+        raw = json.dumps(drops, indent=4).encode('utf-8')
+        atomic_write(drops_db, raw, binary=True)
+        store._record_io("write", drops_db, started, len(raw))
+    return drop_id
+
+
+def plan_batch_claim(stock, tier, services, count, used_by=None):
+    """Claim records for `count` distinct random unused items across `services` (None means all).
+
+    Returns None, claiming nothing, when fewer than `count` are available.
+    """
+    tier_stock = stock.get(tier, {})
+    remaining = {
+        service: tier_stock[service].available
+        for service in (services or tier_stock)
+        if service in tier_stock and tier_stock[service].available
+    }
+    if sum(remaining.values()) < count:
+        return None
+
+    # Spread the picks like `count` single claims would, weighted by what is left
+    shares = dict.fromkeys(remaining, 0)
+    for _ in range(count):
+        service = random.choices(list(remaining), weights=list(remaining.values()))[0]
+        shares[service] += 1
+        remaining[service] -= 1
+
+    used_at = int(time.time())
+    return [
+        {"op": "claim", "tier": tier, "service": service, "index": index, "used_by": used_by, "used_at": used_at}
+        for service, share in shares.items() if share
+        for index in tier_stock[service].pick_many(share)
+    ]
@@ -0,0 +1,53 @@
+import importlib
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def gen(tmp_path, monkeypatch):
+    # The bot opens its databases and logs relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("gen")
+
+
+def test_check_cooldown_without_cooldown_in_config(gen):
+    # The kind of config.json the panel writes when it starts first
+    with open(gen.CONFIG_FILE, 'w') as f:
+        json.dump({"web": {"host": "0.0.0.0", "port": 5000}}, f)
+    last_used = (datetime.now() - timedelta(hours=1)).isoformat()
+    gen.AccountManager.save_cooldowns({"42": {"last_free": last_used, "last_premium": last_used}})
+
+    free = gen.AccountManager.check_cooldown(42, "free")
+    assert timedelta(hours=22) < free <= timedelta(hours=23)
+    assert gen.AccountManager.check_cooldown(42, "premium") is None
+
+
+def test_get_config_merges_sections_over_defaults(gen):
+    with open(gen.CONFIG_FILE, 'w') as f:
+        json.dump({"cooldown": {"free": 60}, "admin_roles": ["Staff"]}, f)
+
+    config = gen.AccountManager.get_config()
+    assert config["cooldown"] == {"free": 60, "premium": gen.DEFAULT_CONFIG["cooldown"]["premium"]}
+    assert config["admin_roles"] == ["Staff"]
+    assert config["embed_color"] == gen.DEFAULT_CONFIG["embed_color"]
+    assert gen.DEFAULT_CONFIG["cooldown"]["free"] == 86400
+
+
+def test_storage_metrics_label_file_names_not_guild_paths(gen):
+    gen.STORAGE_BYTES.clear()
+    gen.record_store_io("append", "guilds/123/accounts.log", 0.001, 10)
+    gen.record_store_io("append", "guilds/456/accounts.log", 0.001, 5)
+    assert gen.STORAGE_BYTES.values() == {("append", "accounts.log"): 15}
+
+
+def test_trace_ids_are_stable_across_recorders(gen, monkeypatch):
+    monkeypatch.setitem(gen.config, 'trace', {**gen.DEFAULT_CONFIG['trace'], 'salt': 'shared'})
+    first, second = gen.TraceRecorder(), gen.TraceRecorder()
+    assert first.anonymize(42) == second.anonymize(42)
+    assert first.anonymize(42) != first.anonymize(43)
+    shared = first.anonymize(42)
+
+    monkeypatch.setitem(gen.config, 'trace', {**gen.DEFAULT_CONFIG['trace'], 'salt': 'other'})
+    assert first.anonymize(42) != shared
@@ -0,0 +1,189 @@
+import time
+
+import pytest
+
+import storage
+from storage import ServiceStock, StockStore, read_snapshot
+
+
+def new_store(directory):
+    return StockStore(
+        str(directory / 'accounts.snap'), str(directory / 'accounts.log'), str(directory / 'accounts.json')
+    )
+
+
+def dump(stock):
+    """Every item, the free list and staged ranges, for comparing two stocks"""
+    return {
+        (tier, service): (list(service_stock), sorted(set(service_stock.free)), service_stock.staged)
+        for tier, services in stock.items()
+        for service, service_stock in services.items()
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return new_store(tmp_path)
+
+
+def add(store, tier, service, credentials):
+    with store.transaction():
+        store.append({"op": "add", "tier": tier, "service": service, "credentials": credentials})
+
+
+def claim(store, tier, service, index, key=None, used_by=1):
+    with store.transaction():
+        store.append({
+            "op": "claim", "tier": tier, "service": service, "index": index,
+            "used_by": used_by, "used_at": int(time.time()), "key": key
+        })
+
+
+def test_take_copies_items_in_order():
+    stock = ServiceStock.from_items({"credentials": name} for name in "abcd")
+    stock.mark_used(2, used_by=7)
+    taken = stock.take([3, 2, 0])
+    assert [taken.credentials(i) for i in range(3)] == ["d", "c", "a"]
+    assert [taken.is_used(i) for i in range(3)] == [False, True, False]
+    assert taken.used_by[1] == 7
+    assert sorted(taken.free) == [0, 2]
+    assert taken.available == 2
+
+
+def test_remove_returns_index_map():
+    stock = ServiceStock.from_items({"credentials": name} for name in "abcde")
+    stock.mark_used(3)
+    remap = stock.remove([1, 2])
+    assert list(remap) == [0, -1, -1, 1, 2]
+    assert [item["credentials"] for item in stock] == ["a", "d", "e"]
+    assert stock.is_used(1)
+    assert sorted(stock.free) == [0, 2]
+    assert stock.available == 2
+
+
+def test_purge_around_staged_drop(store):
+    add(store, "free", "x", ["bad1", "ok1", "bad2"])
+    with store.transaction():
+        store.append({"op": "stage", "tier": "free", "service": "x", "drop": "d1", "credentials": ["bad3", "bad4"]})
+    add(store, "free", "x", ["bad5"])
+
+    assert store.apply_bulk({"op": "purge", "tier": "free", "service": "x", "pattern": "bad*"}) == 3
+    service_stock = store.read()["free"]["x"]
+    assert [item["credentials"] for item in service_stock] == ["ok1", "bad3", "bad4"]
+    assert service_stock.staged == {"d1": [1, 3]}
+    assert service_stock.available == 1
+
+    with store.transaction():
+        store.append({"op": "release", "tier": "free", "service": "x", "drop": "d1", "until": 3})
+    assert sorted(service_stock.free) == [0, 1, 2]
+    assert service_stock.staged == {}
+
+
+def test_move_into_existing_service_follows_claim_keys(store):
+    add(store, "free", "x", ["a1", "b1", "a2", "b2"])
+    add(store, "premium", "x", ["p1"])
+    claim(store, "free", "x", 2, key="moved")
+    claim(store, "free", "x", 3, key="kept")
+
+    assert store.apply_bulk({"op": "move", "tier": "free", "service": "x", "pattern": "a*", "to": "premium"}) == 2
+    stock = store.read()
+    assert [item["credentials"] for item in stock["free"]["x"]] == ["b1", "b2"]
+    assert [item["credentials"] for item in stock["premium"]["x"]] == ["p1", "a1", "a2"]
+    assert stock["premium"]["x"].is_used(2)
+    assert stock["premium"]["x"].available == 2
+
+    assert store.claimed("moved") == ("premium", "x", 2, True)
+    assert store.claimed("kept") == ("free", "x", 1, True)
+
+
+def test_move_into_new_service_follows_claim_keys(store):
+    add(store, "free", "y", ["a1", "b1", "a2"])
+    claim(store, "free", "y", 2, key="moved")
+
+    assert store.apply_bulk({"op": "move", "tier": "free", "service": "y", "pattern": "a*", "to": "premium"}) == 2
+    assert store.claimed("moved") == ("premium", "y", 1, True)
+    assert store.read()["premium"]["y"].credentials(1) == "a2"
+
+
+def test_requeue_then_pick(store):
+    add(store, "free", "x", [f"item{i}" for i in range(10)])
+    since = int(time.time())
+    for index in range(6):
+        claim(store, "free", "x", index, key=f"k{index}")
+
+    assert store.apply_bulk({"op": "requeue", "tier": "free", "service": "x", "since": since}) == 6
+    assert store.claimed("k0") is None
+    service_stock = store.read()["free"]["x"]
+    assert service_stock.available == 10
+
+    picked = service_stock.pick_many(10)
+    assert sorted(picked) == list(range(10))
+    claim(store, "free", "x", picked[0])
+    assert service_stock.pick_random() in set(range(10)) - {picked[0]}
+    assert sorted(service_stock.pick_many(20)) == sorted(set(range(10)) - {picked[0]})
+
+
+def test_dry_run_changes_nothing(store):
+    add(store, "free", "x", ["a1", "b1"])
+    version = store.version
+    assert store.apply_bulk({"op": "purge", "tier": "free", "service": "x", "pattern": "a*"}, dry_run=True) == 1
+    assert store.version == version
+    assert len(store.read()["free"]["x"]) == 2
+
+
+def test_replaying_the_log_gives_the_same_state(tmp_path, store):
+    add(store, "free", "x", ["a1", "b1", "a2", "b2", "c1"])
+    add(store, "premium", "x", ["p1"])
+    with store.transaction():
+        store.append({"op": "stage", "tier": "free", "service": "x", "drop": "d1", "credentials": ["a3", "b3"]})
+    claim(store, "free", "x", 1, key="k1")
+    claim(store, "free", "x", 4, key="k4")
+    store.apply_bulk({"op": "move", "tier": "free", "service": "x", "pattern": "a*", "to": "premium"})
+    store.apply_bulk({"op": "purge", "tier": "free", "service": "x", "pattern": "c*"})
+    store.apply_bulk({"op": "requeue", "tier": "free", "since": 0})
+    with store.transaction():
+        store.append({"op": "release", "tier": "free", "service": "x", "drop": "d1", "until": 2})
+
+    replayed = new_store(tmp_path)
+    assert dump(replayed.read()) == dump(store.read())
+    assert replayed.claim_keys == store.claim_keys
+
+    store.compact()
+    compacted = new_store(tmp_path)
+    assert dump(compacted.read()) == dump(store.read())
+
+
+def test_snapshot_is_not_mapped_without_fcntl(monkeypatch, store):
+    add(store, "free", "x", ["a1", "b1"])
+    store.compact()
+    # Windows: a mapped snapshot could not be replaced by the next compaction
+    monkeypatch.setattr(storage, "fcntl", None)
+    stock, generation, directory, buffer = read_snapshot(store.snapshot_path)
+    assert isinstance(buffer, bytes)
+    assert [item["credentials"] for item in stock["free"]["x"]] == ["a1", "b1"]
+
+
+def test_read_is_unaffected_by_later_records(store):
+    add(store, "free", "x", ["a1", "b1"])
+    stock = store.read()
+    service_stock = stock["free"]["x"]
+    add(store, "free", "y", ["c1"])
+    store.apply_bulk({"op": "purge", "tier": "free", "service": "x", "pattern": "a*"})
+
+    assert list(stock["free"]) == ["x"]
+    assert [item["credentials"] for item in service_stock] == ["a1", "b1"]
+    assert sorted(store.read()["free"]) == ["x", "y"]
+
+
+def test_claim_batch_with_a_key_replays_the_same_batch(store):
+    add(store, "free", "x", [f"item{i}" for i in range(10)])
+    first = store.claim_batch("free", 4, key="form1")
+    again = store.claim_batch("free", 4, key="form1")
+    other = store.claim_batch("free", 4, key="form2")
+
+    assert [item["replayed"] for item in first] == [False] * 4
+    assert [item["replayed"] for item in again] == [True] * 4
+    assert sorted(item["credentials"] for item in again) == sorted(item["credentials"] for item in first)
+    assert not {item["credentials"] for item in other} & {item["credentials"] for item in first}
+    assert store.read()["free"]["x"].available == 2
+    assert store.claim_batch("free", 3, key="form3") is None
@@ -1,17 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, stream_with_context, g, has_request_context
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import json
+import time
+import logging
+import functools
+import gzip
 import secrets
+import hmac
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as VerifyTimeout
 from datetime import datetime
 
+from storage import (
+    file_lock, atomic_write, plan_waves, stage_drop, iter_export_rows, iter_export_lines,
+    Partition, PartitionCache, list_partitions
+)
+
 # Initialize Flask app
 app = Flask(__name__)
 
+# Structured slow-request log, shared with the bot
+slow_logger = logging.getLogger('slowlog')
+slow_logger.propagate = False
+slow_logger.setLevel(logging.INFO)
+if not slow_logger.handlers:
+    _slow_handler = logging.FileHandler('slow.log')
+    _slow_handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_logger.addHandler(_slow_handler)
+
 # Configuration
 CONFIG_FILE = 'config.json'
 ACCOUNTS_DB = 'accounts.json'
 STATS_DB = 'stats.json'
+DROPS_DB = 'drops.json'
 
 # Default configuration with auto-generated secret key
 DEFAULT_CONFIG = {
@@ -21,10 +44,46 @@ DEFAULT_CONFIG = {
         "secret_key": secrets.token_hex(32),
         "username": "admin",
         "password": generate_password_hash("admin123")  # Default password
-    }
+    },
+    "profiling": {
+        "slow_request_ms": 500
+    },
+    "api": {
+        "token": "",
+        "max_age": 5
+    },
+    "login": {
+        "free_attempts": 3,
+        "base_delay": 2,
+        "max_delay": 900,
+        "workers": 2,
+        "verify_timeout": 10,
+        "remember_seconds": 3600
+    },
+    "batch_claim_max": 1000  # Shared with the bot's /batchclaim
 }
 
 # Helper functions
+def profiled_call(func):
+    """Attribute time spent in a storage helper to the current request"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not has_request_context():
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            g.storage_seconds = g.get('storage_seconds', 0.0) + time.perf_counter() - start
+            g.storage_calls = g.get('storage_calls', 0) + 1
+    return wrapper
+
+def record_bytes(key, count):
+    """Count JSON bytes read or serialized by the current request"""
+    if has_request_context():
+        g.setdefault(key, 0)
+        setattr(g, key, getattr(g, key) + count)
+
 def load_config():
     """Load or create configuration file"""
     if os.path.exists(CONFIG_FILE):
@@ -39,29 +98,168 @@ def load_config():
         json.dump(DEFAULT_CONFIG, f, indent=4)
     return DEFAULT_CONFIG.copy()
 
+@profiled_call
 def save_config(config):
     """Save configuration to file"""
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
+    raw = json.dumps(config, indent=4).encode('utf-8')
+    atomic_write(CONFIG_FILE, raw, binary=True)
+    record_bytes('bytes_serialized', len(raw))
+
+def record_store_io(op, path, seconds, nbytes):
+    """Count stock snapshot and log I/O against the current request"""
+    record_bytes('bytes_serialized' if op in ("append", "snapshot_write") else 'bytes_read', nbytes)
 
-def load_accounts():
-    """Load accounts database"""
-    if os.path.exists(ACCOUNTS_DB):
-        with open(ACCOUNTS_DB, 'r') as f:
-            return json.load(f)
-    return {"free": {}, "premium": {}}
+# Same files and locks as the bot, so both see each other's changes
+partitions = PartitionCache(lambda guild_id: Partition(guild_id, on_io=record_store_io))
 
-def load_stats():
+def current_guild():
+    """Guild partition selected by the request, or None for the shared databases"""
+    guild = request.values.get('guild', '')
+    # Only existing partitions; opening a new one would create it on disk
+    return int(guild) if guild.isdigit() and int(guild) in guild_partitions() else None
+
+def guild_partitions():
+    """Guild partitions the panel can select, empty unless partitions.by_guild is on"""
+    return list_partitions() if config.get('partitions', {}).get('by_guild', False) else []
+
+@profiled_call
+def load_stock(guild_id=None):
+    """Load accounts as {type: {service: ServiceStock}}"""
+    return partitions.get(guild_id).stock.read()
+
+@profiled_call
+def load_stats(guild_id=None):
     """Load statistics"""
-    if os.path.exists(STATS_DB):
-        with open(STATS_DB, 'r') as f:
-            return json.load(f)
+    stats_db = partitions.get(guild_id).stats_db
+    if os.path.exists(stats_db):
+        with open(stats_db, 'rb') as f:
+            raw = f.read()
+        record_bytes('bytes_read', len(raw))
+        return json.loads(raw)
     return {"free_generated": 0, "premium_generated": 0, "accounts_added": 0}
 
+@profiled_call
+def add_accounts(account_type, service, credentials_list, guild_id=None):
+    """Append new accounts to the stock log"""
+    store = partitions.get(guild_id).stock
+    with store.transaction():
+        store.append({
+            "op": "add",
+            "tier": account_type,
+            "service": service,
+            "credentials": list(credentials_list)
+        })
+
+@profiled_call
+def bulk_update(record, dry_run=False, guild_id=None):
+    """Count the items a purge, move or requeue record touches and, unless dry_run, apply it"""
+    return partitions.get(guild_id).stock.apply_bulk(record, dry_run)
+
+@profiled_call
+def claim_batch(account_type, count, services=None, guild_id=None, key=None):
+    """Claim `count` distinct accounts in one write; None if fewer are available, the same batch again for a repeated key"""
+    return partitions.get(guild_id).stock.claim_batch(account_type, count, services, key=key)
+
+@profiled_call
+def save_stats(stats, guild_id=None):
+    """Save statistics"""
+    raw = json.dumps(stats, indent=4).encode('utf-8')
+    atomic_write(partitions.get(guild_id).stats_db, raw, binary=True)
+    record_bytes('bytes_serialized', len(raw))
+
 # Load configuration
 config = load_config()
 app.secret_key = config['web']['secret_key']
 
+# Login throttling
+def login_settings():
+    return {**DEFAULT_CONFIG['login'], **config.get('login', {})}
+
+class LoginThrottle:
+    """Failed login attempts per IP or username, with exponential backoff"""
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def retry_after(self, key, now=None):
+        """Seconds until `key` may try again, 0 if it is not blocked"""
+        now = now or time.monotonic()
+        with self._lock:
+            entry = self._failures.get(key)
+            return max(0.0, entry[1] - now) if entry else 0.0
+
+    def failure(self, key, now=None):
+        """Record a failed attempt and return the resulting delay"""
+        settings = login_settings()
+        now = now or time.monotonic()
+        with self._lock:
+            if len(self._failures) >= self.MAX_KEYS:
+                self._prune(now, settings['max_delay'])
+            count = self._failures.get(key, [0, 0.0])[0] + 1
+            excess = count - settings['free_attempts']
+            delay = min(settings['base_delay'] * 2 ** (excess - 1), settings['max_delay']) if excess > 0 else 0
+            self._failures[key] = [count, now + delay]
+            return delay
+
+    def success(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def _prune(self, now, max_delay):
+        """Forget keys whose backoff ran out long ago"""
+        for key, (_, blocked_until) in list(self._failures.items()):
+            if now - blocked_until > max_delay:
+                del self._failures[key]
+
+login_throttle = LoginThrottle()
+
+# Password hashes are deliberately slow, so they run on a small pool and never queue unbounded
+login_pool = ThreadPoolExecutor(max_workers=login_settings()['workers'], thread_name_prefix='login')
+login_slots = threading.BoundedSemaphore(login_settings()['workers'] * 2)
+
+# Successful verifications, keyed by an HMAC of the stored hash and credentials
+verified_logins = {}
+verified_logins_lock = threading.Lock()
+
+def login_digest(username, password):
+    message = f"{config['web']['password']}\0{username}\0{password}".encode()
+    return hmac.new(app.secret_key.encode(), message, hashlib.sha256).hexdigest()
+
+def verify_login(username, password):
+    """Check credentials once, off the request thread; None when the pool is saturated"""
+    if username != config['web']['username']:
+        return False
+
+    settings = login_settings()
+    digest = login_digest(username, password)
+    if verified_logins.get(digest, 0) > time.monotonic():
+        return True
+
+    if not login_slots.acquire(blocking=False):
+        return None
+    try:
+        future = login_pool.submit(check_password_hash, config['web']['password'], password)
+    except Exception:
+        login_slots.release()
+        raise
+    # A timed-out hash keeps its slot until it actually finishes, so the pool can't be flooded
+    future.add_done_callback(lambda _: login_slots.release())
+    try:
+        valid = future.result(timeout=settings['verify_timeout'])
+    except VerifyTimeout:
+        return None
+
+    if valid:
+        now = time.monotonic()
+        with verified_logins_lock:
+            for key, expires in list(verified_logins.items()):
+                if expires <= now:
+                    verified_logins.pop(key, None)
+            verified_logins[digest] = now + settings['remember_seconds']
+    return valid
+
 # Create default templates
 def create_templates():
     templates_dir = 'templates'
@@ -329,6 +527,35 @@ def create_templates():
             with open(path, 'w') as f:
                 f.write(content)
 
+# Request profiling
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_timer(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+
+    elapsed = time.perf_counter() - started
+    threshold_ms = config.get('profiling', DEFAULT_CONFIG['profiling']).get('slow_request_ms', 500)
+    if elapsed * 1000 >= threshold_ms:
+        slow_logger.info(json.dumps({
+            "time": datetime.now().isoformat(),
+            "source": "web",
+            "endpoint": request.endpoint,
+            "method": request.method,
+            "status": response.status_code,
+            "wall_ms": round(elapsed * 1000, 3),
+            "storage_ms": round(g.get('storage_seconds', 0.0) * 1000, 3),
+            "storage_calls": g.get('storage_calls', 0),
+            "bytes_read": g.get('bytes_read', 0),
+            "bytes_serialized": g.get('bytes_serialized', 0),
+            "slow": True
+        }))
+    return response
+
 # Routes
 @app.route('/')
 def index():
@@ -342,20 +569,29 @@ def login():
         return redirect(url_for('dashboard'))
         
     if request.method == 'POST':
-        username = request.form.get('username')
-        password = request.form.get('password')
+        username = request.form.get('username', '')
+        password = request.form.get('password', '')
+        keys = [f"ip:{request.remote_addr}", f"user:{username}"]
+        
+        # Blocked attempts are rejected before any hashing
+        retry_after = max(login_throttle.retry_after(key) for key in keys)
+        if retry_after:
+            flash(f'Too many failed logins. Try again in {int(retry_after) + 1} seconds.', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(int(retry_after) + 1)}
         
-        # Debug output
-        print(f"Login attempt: {username}")
-        print(f"Stored username: {config['web']['username']}")
-        print(f"Password match: {check_password_hash(config['web']['password'], password)}")
+        valid = verify_login(username, password)
+        if valid is None:
+            flash('The server is busy. Please try again shortly.', 'error')
+            return render_template('login.html'), 503
         
-        if (username == config['web']['username'] and 
-            check_password_hash(config['web']['password'], password)):
+        if valid:
+            for key in keys:
+                login_throttle.success(key)
             session['logged_in'] = True
             return redirect(url_for('dashboard'))
         else:
-            print("Login failed - invalid credentials")
+            delay = max(login_throttle.failure(key) for key in keys)
+            app.logger.warning(f"Failed login for {username!r} from {request.remote_addr}, next attempt in {delay}s")
             flash('Invalid username or password', 'error')
             
     return render_template('login.html')
@@ -365,7 +601,8 @@ def dashboard():
     if 'logged_in' not in session:
         return redirect(url_for('login'))
     
-    accounts = load_accounts()
+    guild_id = current_guild()
+    stock = load_stock(guild_id)
     stats = {
         "free": 0,
         "premium": 0,
@@ -374,21 +611,41 @@ def dashboard():
     
     # Calculate account statistics
     for acc_type in ["free", "premium"]:
-        for service, acc_list in accounts[acc_type].items():
-            available = sum(1 for acc in acc_list if not acc.get("used", False))
+        for service, service_stock in stock[acc_type].items():
+            available = service_stock.available
             if available > 0:
                 if service not in stats["services"]:
                     stats["services"][service] = {"free": 0, "premium": 0}
                 stats["services"][service][acc_type] = available
                 stats[acc_type] += available
     
-    total_stats = load_stats()
+    total_stats = load_stats(guild_id)
+    
+    # Claim trends come from the pre-aggregated rollups, never from scanning the stock
+    rollups = partitions.get(guild_id).stock.rollups
+    for trend in rollups.trends(stock):
+        counts = stats["services"].setdefault(trend["service"], {"free": 0, "premium": 0})
+        counts["last_day"] = counts.get("last_day", 0) + trend["last_day"]
+        counts["per_hour"] = counts.get("per_hour", 0) + trend["per_hour"]
+    for counts in stats["services"].values():
+        if counts.get("per_hour"):
+            counts["eta_hours"] = (counts["free"] + counts["premium"]) / counts["per_hour"]
+    
+    series = {tier: rollups.series("hour", 48, tier) for tier in ["free", "premium"]}
+    chart = {
+        "labels": [datetime.fromtimestamp(start).strftime('%d %b %H:00') for start, _ in series["free"]],
+        "free": [count for _, count in series["free"]],
+        "premium": [count for _, count in series["premium"]]
+    }
     
     return render_template(
         'dashboard.html',
         title='Dashboard',
         stats=stats,
-        total_stats=total_stats
+        total_stats=total_stats,
+        chart=chart,
+        guild=guild_id,
+        guilds=guild_partitions()
     )
 
 @app.route('/accounts')
@@ -396,17 +653,18 @@ def accounts():
     if 'logged_in' not in session:
         return redirect(url_for('login'))
         
-    accounts = load_accounts()
+    guild_id = current_guild()
+    stock = load_stock(guild_id)
     free_services = {}
     premium_services = {}
     
-    for service, acc_list in accounts["free"].items():
-        count = sum(1 for acc in acc_list if not acc.get("used", False))
+    for service, service_stock in stock["free"].items():
+        count = service_stock.available
         if count > 0:
             free_services[service] = count
             
-    for service, acc_list in accounts["premium"].items():
-        count = sum(1 for acc in acc_list if not acc.get("used", False))
+    for service, service_stock in stock["premium"].items():
+        count = service_stock.available
         if count > 0:
             premium_services[service] = count
     
@@ -414,7 +672,11 @@ def accounts():
         'accounts.html',
         title='Account Management',
         free_services=free_services,
-        premium_services=premium_services
+        premium_services=premium_services,
+        guild=guild_id,
+        guilds=guild_partitions(),
+        batch_claim_max=config.get('batch_claim_max', DEFAULT_CONFIG['batch_claim_max']),
+        claim_token=secrets.token_hex(16)
     )
 
 @app.route('/upload-accounts', methods=['POST'])
@@ -425,38 +687,310 @@ def upload_accounts():
     account_type = request.form.get('account_type')
     service = request.form.get('service')
     file = request.files.get('accounts')
+    guild_id = current_guild()
     
     if not file or not file.filename.endswith('.txt'):
         flash('Please upload a valid .txt file', 'error')
-        return redirect(url_for('accounts'))
+        return redirect(url_for('accounts', guild=guild_id))
+
+    if account_type not in ("free", "premium"):
+        flash('Please choose a valid account type', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+    
+    try:
+        release_at = request.form.get('release_at')
+        release_time = datetime.fromisoformat(release_at) if release_at else None
+        wave_size = int(request.form['wave_size']) if request.form.get('wave_size') else None
+        interval = int(request.form.get('interval_minutes') or 10) * 60
+        if (wave_size is not None and wave_size < 1) or interval < 0:
+            raise ValueError(wave_size)
+    except ValueError:
+        flash('Please enter a valid release time, wave size and interval', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
     
     try:
         accounts_list = file.read().decode('utf-8').splitlines()
         accounts_list = [acc.strip() for acc in accounts_list if acc.strip()]
+        if not accounts_list:
+            flash("The file doesn't contain any valid accounts", 'error')
+            return redirect(url_for('accounts', guild=guild_id))
         
-        accounts = load_accounts()
-        if service not in accounts[account_type]:
-            accounts[account_type][service] = []
-            
-        accounts[account_type][service].extend([{
-            "credentials": acc,
-            "used": False,
-            "used_by": None,
-            "used_at": None
-        } for acc in accounts_list])
-        
-        save_accounts(accounts)
+        if release_time:
+            # Staged now, made visible by the bot at release time
+            waves = plan_waves(len(accounts_list), release_time.timestamp(), wave_size, interval)
+            drop_id = stage_drop(partitions.get(guild_id), DROPS_DB, account_type, service, accounts_list, waves)
+        else:
+            add_accounts(account_type, service, accounts_list, guild_id)
         
         # Update stats
-        stats = load_stats()
-        stats["accounts_added"] += len(accounts_list)
-        save_stats(stats)
+        with file_lock(partitions.get(guild_id).stats_db):
+            stats = load_stats(guild_id)
+            stats["accounts_added"] = stats.get("accounts_added", 0) + len(accounts_list)
+            save_stats(stats, guild_id)
         
-        flash(f'Successfully added {len(accounts_list)} {account_type} accounts for {service}', 'success')
+        if release_time:
+            flash(
+                f'Staged drop {drop_id}: {len(accounts_list)} {account_type} accounts for {service}, '
+                f'released from {release_time:%Y-%m-%d %H:%M} in {len(waves)} wave(s)',
+                'success'
+            )
+        else:
+            flash(f'Successfully added {len(accounts_list)} {account_type} accounts for {service}', 'success')
     except Exception as e:
         flash('An error occurred while processing the file', 'error')
         
-    return redirect(url_for('accounts'))
+    return redirect(url_for('accounts', guild=guild_id))
+
+@app.route('/bulk', methods=['POST'])
+def bulk_accounts():
+    if 'logged_in' not in session:
+        return redirect(url_for('login'))
+    
+    action = request.form.get('action')
+    account_type = request.form.get('account_type') or None
+    service = request.form.get('service', '').strip() or None
+    pattern = request.form.get('pattern', '').strip() or None
+    dry_run = bool(request.form.get('dry_run'))
+    guild_id = current_guild()
+    
+    if account_type not in (None, "free", "premium"):
+        flash('Please choose a valid account type', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+    
+    if action == 'purge':
+        if not account_type or not (service or pattern):
+            flash('Purging needs an account type and a service, a pattern or both', 'error')
+            return redirect(url_for('accounts', guild=guild_id))
+        record = {"op": "purge", "tier": account_type, "service": service, "pattern": pattern}
+    elif action == 'requeue':
+        try:
+            since = datetime.fromisoformat(request.form.get('since', ''))
+        except ValueError:
+            flash('Please enter a valid time to requeue claims from', 'error')
+            return redirect(url_for('accounts', guild=guild_id))
+        record = {"op": "requeue", "tier": account_type, "service": service, "since": int(since.timestamp())}
+    elif action == 'move':
+        to_type = request.form.get('to_type')
+        if not account_type or not service or to_type not in ("free", "premium") or to_type == account_type:
+            flash('Moving needs a service and two different account types', 'error')
+            return redirect(url_for('accounts', guild=guild_id))
+        record = {"op": "move", "tier": account_type, "service": service, "to": to_type, "pattern": pattern}
+    else:
+        flash('Unknown bulk action', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+    
+    try:
+        count = bulk_update(record, dry_run, guild_id)
+        if dry_run:
+            flash(f'Dry run: {action} would affect {count} accounts', 'success')
+        else:
+            flash(f'{action.capitalize()} affected {count} accounts', 'success')
+    except Exception as e:
+        flash('An error occurred while updating accounts', 'error')
+    
+    return redirect(url_for('accounts', guild=guild_id))
+
+@app.route('/batch-claim', methods=['POST'])
+def batch_claim():
+    if 'logged_in' not in session:
+        return redirect(url_for('login'))
+    
+    account_type = request.form.get('account_type')
+    services = [s.strip() for s in request.form.get('services', '').split(',') if s.strip()] or None
+    guild_id = current_guild()
+    
+    if account_type not in ("free", "premium"):
+        flash('Please choose a valid account type', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+    
+    limit = config.get('batch_claim_max', DEFAULT_CONFIG['batch_claim_max'])
+    try:
+        count = int(request.form.get('count', ''))
+        if not 1 <= count <= limit:
+            raise ValueError(count)
+    except ValueError:
+        flash(f'Please enter a count between 1 and {limit}', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+    
+    # The form's one-time token; a resubmitted form gets the batch it already claimed
+    token = request.form.get('claim_token', '')
+    key = f"panel-{token}" if token.isalnum() and len(token) <= 64 else None
+    try:
+        items = claim_batch(account_type, count, services, guild_id, key)
+    except Exception as e:
+        flash('An error occurred while claiming accounts', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+    
+    if items is None:
+        flash(f'Not enough {account_type} accounts to pull {count}. Nothing was claimed.', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+    
+    if not items[0]["replayed"]:
+        with file_lock(partitions.get(guild_id).stats_db):
+            stats = load_stats(guild_id)
+            stats[f"{account_type}_generated"] = stats.get(f"{account_type}_generated", 0) + len(items)
+            save_stats(stats, guild_id)
+    
+    content = "".join(f"{item['service']} | {item['credentials']}\n" for item in items)
+    filename = f"{account_type}-accounts-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+    return Response(
+        content,
+        mimetype='text/plain',
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@app.route('/export')
+def export():
+    if 'logged_in' not in session:
+        return redirect(url_for('login'))
+
+    fmt = request.args.get('format', 'ndjson')
+    account_type = request.args.get('account_type') or None
+    service = request.args.get('service') or None
+    status = request.args.get('status') or None
+
+    guild_id = current_guild()
+
+    if fmt not in ('ndjson', 'csv'):
+        flash('Export format must be NDJSON or CSV', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+
+    if account_type not in (None, 'free', 'premium'):
+        flash('Account type must be free or premium', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+
+    if status not in (None, 'available', 'used'):
+        flash('Status must be available or used', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+        until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format', 'error')
+        return redirect(url_for('accounts', guild=guild_id))
+
+    rows = iter_export_rows(load_stock(guild_id), account_type, service, status, since, until)
+    filename = f"export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+
+    return Response(
+        stream_with_context(iter_export_lines(rows, fmt)),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+# Read-only JSON API
+def api_authorized():
+    """Panel session, or the configured bearer token"""
+    if 'logged_in' in session:
+        return True
+    token = config.get('api', {}).get('token')
+    supplied = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode())
+
+def api_response(version, build):
+    """Serve build() as JSON with a strong ETag; unchanged versions get a 304 without building"""
+    settings = {**DEFAULT_CONFIG['api'], **config.get('api', {})}
+    encoding = 'gzip' if request.accept_encodings['gzip'] else None
+    etag = hashlib.sha256(f"{request.full_path}\0{version}\0{encoding}".encode()).hexdigest()[:32]
+    headers = {
+        "Cache-Control": f"private, max-age={settings['max_age']}, must-revalidate",
+        "Vary": "Accept-Encoding, Authorization"
+    }
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        body = json.dumps(build(), separators=(',', ':')).encode()
+        record_bytes('bytes_serialized', len(body))
+        if encoding:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = encoding
+        response = Response(body, mimetype='application/json', headers=headers)
+    response.set_etag(etag)
+    return response
+
+def api_unauthorized():
+    return Response(json.dumps({"error": "unauthorized"}), status=401, mimetype='application/json')
+
+@app.route('/api/stock')
+def api_stock():
+    if not api_authorized():
+        return api_unauthorized()
+    
+    guild_id = current_guild()
+    store = partitions.get(guild_id).stock
+    stock = store.read()
+    
+    def build():
+        return {
+            acc_type: {
+                "available": sum(service_stock.available for service_stock in stock[acc_type].values()),
+                "services": {
+                    service: service_stock.available
+                    for service, service_stock in sorted(stock[acc_type].items())
+                    if service_stock.available
+                }
+            }
+            for acc_type in ["free", "premium"]
+        }
+    
+    return api_response(store.version, build)
+
+@app.route('/api/stats')
+def api_stats():
+    if not api_authorized():
+        return api_unauthorized()
+    
+    guild_id = current_guild()
+    partition = partitions.get(guild_id)
+    store = partition.stock
+    store.read()
+    try:
+        st = os.stat(partition.stats_db)
+        stats_version = f"{st.st_ino}.{st.st_mtime_ns}.{st.st_size}"
+    except FileNotFoundError:
+        stats_version = "none"
+    # Rolling windows move on even without new claims
+    version = f"{store.version}:{stats_version}:{int(time.time() // 60)}"
+    
+    def build():
+        total_stats = load_stats(guild_id)
+        return {
+            acc_type: {
+                "generated": total_stats.get(f"{acc_type}_generated", 0),
+                "last_hour": store.rollups.total("minute", 60, acc_type),
+                "last_day": store.rollups.total("hour", 24, acc_type)
+            }
+            for acc_type in ["free", "premium"]
+        }
+    
+    return api_response(version, build)
+
+@app.route('/api/services')
+def api_services():
+    if not api_authorized():
+        return api_unauthorized()
+    
+    guild_id = current_guild()
+    store = partitions.get(guild_id).stock
+    stock = store.read()
+    version = f"{store.version}:{int(time.time() // 60)}"
+    
+    def build():
+        trends = {(trend["tier"], trend["service"]): trend for trend in store.rollups.trends(stock)}
+        services = {}
+        for acc_type in ["free", "premium"]:
+            for service in set(stock[acc_type]) | {s for tier, s in trends if tier == acc_type}:
+                service_stock = stock[acc_type].get(service)
+                trend = trends.get((acc_type, service), {})
+                services.setdefault(service, {})[acc_type] = {
+                    "available": service_stock.available if service_stock else 0,
+                    "last_day": trend.get("last_day", 0),
+                    "eta_hours": round(trend["eta_hours"], 2) if trend else None
+                }
+        return {"services": dict(sorted(services.items()))}
+    
+    return api_response(version, build)
 
 @app.route('/settings')
 def settings():
@@ -495,15 +1029,14 @@ if __name__ == '__main__':
     print(f"Password: admin123 (default)")
     print("="*50 + "\n")
     
-
-print("\nRESETTING CREDENTIALS TO DEFAULT!")
-config['web']['username'] = "admin"
-config['web']['password'] = generate_password_hash("admin123")  # Reset to known password
-save_config(config)
-print("Credentials have been reset to: admin/admin123")
-
-app.run(
-    host=config['web']['host'],
-    port=config['web']['port'],
-    debug=True
-)
\ No newline at end of file
+    print("\nRESETTING CREDENTIALS TO DEFAULT!")
+    config['web']['username'] = "admin"
+    config['web']['password'] = generate_password_hash("admin123")  # Reset to known password
+    save_config(config)
+    print("Credentials have been reset to: admin/admin123")
+    
+    app.run(
+        host=config['web']['host'],
+        port=config['web']['port'],
+        debug=True
+    )